@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the tests.
+"""
+import os
+import sqlite3
+
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def database(tmp_path) -> str:
+    """
+    A new database, made from dfstat.sql.
+    """
+    name = str(tmp_path / 'dfstat.db')
+    with open(os.path.join(here, 'dfstat.sql')) as f:
+        conn = sqlite3.connect(name)
+        conn.executescript(f.read())
+        conn.close()
+    return name
+
+
+@pytest.fixture
+def db(database:str) -> object:
+    """
+    A DFStatsDB on the new database.
+    """
+    from dfdata import DFStatsDB
+    db = DFStatsDB(database)
+    yield db
+    db.close()
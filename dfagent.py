@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+import typing
+from   typing import *
+from   collections.abc import Iterable
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 11)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+import getpass
+import json
+import logging
+import socket
+import threading
+import time
+import tomllib
+
+###
+# Installed libraries like numpy, pandas, paramiko
+###
+
+###
+# From hpclib
+###
+import fileutils
+import linuxutils
+from   sloppytree import SloppyTree
+from   urdecorators import trap
+from   urlogger import URLogger
+
+###
+# imports and objects that were written for this project.
+###
+from   localdf import statvfs_df
+
+###
+# Global objects
+###
+mynetid = getpass.getuser()
+logger = None
+
+###
+# Credits
+###
+__author__ = mynetid
+__copyright__ = 'Copyright 2024, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = mynetid
+__email__ = f'{mynetid}@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+###
+# dfagent runs on a monitored host, and pushes its measurements to
+# the collector (dfstat) rather than waiting for dfstat to come and
+# get them with ssh. Each connection carries one sample of the host's
+# partitions, one JSON object per line:
+#
+#   {"host": "adam", "partition": "/home", "size": 1795845384,
+#       "used": 146868444, "avail": 1648976940, "ts": 1717171717}
+#
+# or, if a partition could not be measured,
+#
+#   {"host": "adam", "partition": "/home", "error": 2, "ts": 1717171717}
+#
+# ts is when the sample was taken, in epoch seconds. Records without
+# it are stamped when they arrive.
+# The collector side is the AgentListener, which dfstat starts when
+# the agent table in dfstat.toml has a port.
+###
+
+@trap
+def sample(host:str, partitions:Iterable) -> Generator:
+    """
+    One record for each partition of this host.
+    """
+    for partition in partitions:
+        if not partition.startswith('/'): continue
+        ts = int(time.time())
+        try:
+            size, used, avail = statvfs_df(partition)
+            yield {'host': host, 'partition': partition,
+                'size': size, 'used': used, 'avail': avail, 'ts': ts}
+        except OSError as e:
+            yield {'host': host, 'partition': partition, 'error': e.errno, 'ts': ts}
+
+
+@trap
+def push(records:Iterable, collector:tuple, timeout:float=30) -> bool:
+    """
+    Send the records to the collector on one connection.
+    """
+    try:
+        with socket.create_connection(collector, timeout=timeout) as s:
+            s.sendall("".join(json.dumps(_, separators=(',', ':')) + '\n'
+                for _ in records).encode())
+        return True
+
+    except OSError as e:
+        logger and logger.error(f"Cannot reach {collector}. {e=}")
+        return False
+
+
+class AgentListener:
+    """
+    Accept the records pushed by the agents, and hand them to the
+    MeasurementWriter. There is one thread per connection, like 
+    urmessage, and each connection's records are written together.
+
+    There is no authentication beyond this: a record is accepted only
+    for one of the agent hosts, and only if it comes from one of the
+    addresses that the host's name resolves to, or from one of the
+    allowed addresses. Agents on this computer (or behind a relay)
+    all arrive from the same address, so it must be allowed for them
+    to be heard.
+    """
+
+    def __init__(self, writer:object, address:tuple, targets:dict, logger:object,
+            hosts:Iterable=(), allow:Iterable=()):
+        self.writer = writer
+        self.address = address
+        self.targets = { host : set(partitions) for host, partitions in targets.items() }
+        self.logger = logger
+        self.hosts = set(hosts)
+        self.allow = set(allow)
+        self.server_socket = None
+
+
+    def start(self) -> None:
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind(self.address)
+        self.server_socket.listen(16)
+        threading.Thread(target=self.accept, daemon=True).start()
+
+
+    def stop(self) -> None:
+        try:
+            self.server_socket.close()
+        except Exception as e:
+            pass
+
+
+    def accept(self) -> None:
+        while True:
+            try:
+                client_socket, addr = self.server_socket.accept()
+            except OSError as e:
+                return
+            threading.Thread(target=self.handle, args=(client_socket, addr),
+                daemon=True).start()
+
+
+    def is_from(self, host:str, address:str) -> bool:
+        """
+        Whether address is allowed, or one of host's addresses.
+        """
+        if address in self.allow:
+            return True
+        try:
+            return address in { _[4][0] for _ in socket.getaddrinfo(host, None) }
+        except OSError as e:
+            self.logger.error(f"Cannot resolve {host}. {e=}")
+            return False
+
+
+    def handle(self, client_socket:object, addr:tuple) -> None:
+        """
+        Read the records from one agent, and queue the ones that are
+        about partitions we monitor, from the agent hosts themselves.
+        """
+        verified = {}
+        measurements, errors = [], []
+        try:
+            client_socket.settimeout(30)
+            with client_socket.makefile('r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        host, partition = record['host'], record['partition']
+                        ts = int(record.get('ts') or time.time())
+                    except (ValueError, KeyError, TypeError) as e:
+                        self.logger.error(f"Malformed record from {addr}: {line!r}")
+                        continue
+
+                    if host not in self.hosts:
+                        self.logger.error(f"{host} from {addr} is not an agent host.")
+                        continue
+
+                    if host not in verified:
+                        verified[host] = self.is_from(host, addr[0])
+                    if not verified[host]:
+                        self.logger.error(f"Record for {host} from {addr}, which is not {host}.")
+                        continue
+
+                    if partition not in self.targets.get(host, ()):
+                        self.logger.info(f"{host}:{partition} from {addr} is not monitored.")
+                        continue
+
+                    if 'error' in record:
+                        errors.append((host, record['error'], ts))
+                    else:
+                        measurements.append((host, partition, record['size'], record['avail'], ts))
+
+        except (OSError, KeyError) as e:
+            self.logger.error(f"Lost connection to {addr}. {e=}")
+
+        finally:
+            client_socket.close()
+
+        self.writer.put(measurements, errors)
+
+
+@trap
+def dfagent_main(myargs:argparse.Namespace) -> int:
+    global logger
+
+    with open(myargs.input, 'rb') as f:
+        myconfig = SloppyTree(tomllib.load(f))
+
+    agent_config = myconfig.get('agent', {})
+    collector = (myargs.collector or agent_config.get('collector', '127.0.0.1'),
+        myargs.port or agent_config.get('port', 33334))
+    interval = myargs.interval or myconfig.time_interval
+
+    # Without a list of partitions, use the ones in the config file.
+    partitions = myargs.partition or next(
+        (_['partition'] for _ in myconfig.hosts if _['host'] == myargs.name), [])
+    if not partitions:
+        print(f"No partitions to monitor for {myargs.name}.")
+        return os.EX_CONFIG
+
+    while True:
+        push(tuple(sample(myargs.name, partitions)), collector)
+        if myargs.once: break
+        time.sleep(interval)
+
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog="dfagent",
+        description="What dfagent does, dfagent does best.")
+
+    parser.add_argument('-i', '--input', type=str, default="dfstat.toml",
+        help="toml file with the config info.")
+    parser.add_argument('--collector', type=str, default="",
+        help="Address of the computer where dfstat is running.")
+    parser.add_argument('--port', type=int, default=0,
+        help="Port where dfstat listens for agents.")
+    parser.add_argument('--name', type=str, default=socket.gethostname().split('.')[0],
+        help="Name of this host in the config file. Defaults to the hostname.")
+    parser.add_argument('--partition', type=str, nargs='*', default=[],
+        help="Partitions to report, if not the ones in the config file.")
+    parser.add_argument('--interval', type=int, default=0,
+        help="Seconds between samples, if not the time_interval in the config file.")
+    parser.add_argument('--once', action='store_true',
+        help="Send one sample and exit.")
+    parser.add_argument('-f', '--foreground', action='store_true',
+        help="Run in the foreground rather than becoming a daemon.")
+
+    myargs = parser.parse_args()
+
+    if not myargs.foreground and not myargs.once:
+        here = os.getcwd()
+        linuxutils.daemonize_me()
+        os.chdir(here)
+
+    logfile = f"{os.path.basename(__file__)[:-3]}.log"
+    logger = URLogger(logfile=logfile, level=logging.INFO)
+
+    try:
+        sys.exit(globals()[f"{os.path.basename(__file__)[:-3]}_main"](myargs))
+
+    except Exception as e:
+        print(f"Escaped or re-raised exception: {e}")
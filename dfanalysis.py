@@ -17,27 +17,21 @@ if sys.version_info < min_py:
 # Other standard distro imports
 ###
 import argparse
+import concurrent.futures
 import contextlib
 import datetime
 import getpass
 import logging
+import multiprocessing
+import shlex
 import signal
 import time
 
 ###
 # Installed libraries
 ###
-import pandas
 import numpy as np
-import statsmodels.api as sm
-# Use Kwiatkowski-Phillips-Schmidt-Shin (KPSS) test
-# to determine if the data is stationary
-# if p-value of the test is less than 0.05, then
-# the data isn't stationary (it has significant changes)
-# and, hence, hpc@richmond.edu needs to be informed.
-from statsmodels.tsa.stattools import kpss
 mynetid = getpass.getuser()
-from statsmodels.tsa.stattools import adfuller
 
 ###
 # From hpclib
@@ -46,7 +40,17 @@ import fileutils
 import linuxutils
 from   urdecorators import show_exceptions_and_frames as trap
 from   urlogger import URLogger
+from   dfarchive import Archive
 from   dfdata import DFStatsDB
+from   dfretain import Retention
+# Use Kwiatkowski-Phillips-Schmidt-Shin (KPSS) test
+# to determine if the data is stationary
+# if p-value of the test is less than 0.05, then
+# the data isn't stationary (it has significant changes)
+# and, hence, hpc@richmond.edu needs to be informed.
+from   dfkpss import stationarity
+from   dftrend import prescreen, stack, time_to_full
+from   dfwindow import WindowCache
 from   dorunrun import dorunrun
 ###
 # Credits
@@ -61,6 +65,38 @@ __status__ = 'in progress'
 __license__ = 'MIT'
 
 mynetid = getpass.getuser()
+
+###
+# The analyzer's own read-only connection to the database. It is
+# opened in dfanalysis_main(), after dfstat has forked.
+###
+db = None
+
+###
+# The columnar copy of the samples, if there is an archive table in
+# dfstat.toml.
+###
+archive = None
+
+###
+# The last window_size samples of each series, kept between cycles.
+###
+windows = None
+
+###
+# The processes that run the KPSS tests, if there are analysis
+# workers in dfstat.toml.
+###
+pool = None
+
+###
+# The analyzer's connection for writing the forecasts, if there is a
+# forecast table in dfstat.toml, and when each partition's last
+# forecast alert was sent.
+###
+forecast_db = None
+alerted = {}
+
 '''
 @trap
 def handler(signum:int, stack:object=None) -> None:
@@ -82,20 +118,21 @@ def handler(signum:int, stack:object=None) -> None:
         return
 '''
 @trap
-def analyze_diskspace(frame:pandas.DataFrame) -> None:
+def analyze_diskspace(avail_disk:np.ndarray, p_value:float=None) -> None:
     """
     This method uses KPSS test to determine data non-stationarity.
     Data is non-stationary if
         1. Test Statistic > Critical Value
         2. p-value < 0.05
     If data is non-stationary, send email to hpc@richmond.edu
+
+    avail_disk is the window of good measurements of one series,
+    oldest first. If the test has already been done (in the pool),
+    p_value is its result.
     """
-    #columns : host   partition  partition_size  avail_disk  error_code measured_at
     from dfstat import myconfig, logger
-    if (frame["error_code"]==0).any():
-        avail_disk = frame["avail_disk"][frame["error_code"]==0]
-        mu, sigma = 0, 0.1
-        statistic, p_value, n_lags, critical_values = kpss(avail_disk, regression ='ct', store = True)
+    if len(avail_disk):
+        p_value = stationarity([avail_disk])[0] if p_value is None else p_value
         #print(f'Result: The series is {"not " if p_value < 0.05 else ""}stationary')
         
         ### send email if data is non-stationary and if there is memory drop
@@ -110,15 +147,14 @@ def analyze_diskspace(frame:pandas.DataFrame) -> None:
 def send_email(subject:str):
     from dfstat import myconfig, logger
     print("haha")
-    cmd = f"nohup mailx -s {subject} '{myconfig.notification_address[0]}' /dev/null 2>&1 &"
+    cmd = f"nohup mailx -s {shlex.quote(subject)} '{myconfig.notification_addresses[0]}' /dev/null 2>&1 &"
     print(cmd)
     dorunrun(cmd)
 
 @trap
-def is_mem_drop(frame:pandas.DataFrame) -> bool:
+def is_mem_drop(avail_disk:np.ndarray) -> bool:
     
-    print(frame.tail(2))
-    last_two_values = frame.tail(2).to_list()
+    last_two_values = avail_disk[-2:].tolist()
     print("last two", last_two_values)
 
     mem_then = last_two_values[0]
@@ -151,22 +187,83 @@ def fiscaldaemon_events() -> int:
 def run_analysis() -> None:
     """
     We need to get the recent records, where recent is defined as
-    more recent than a cutoff value related to the measurement
-    interval. IOW, the last "N" values.
+    the last "N" values of each series. Since the partitions are not
+    all polled at the same interval, a fixed stretch of time would
+    hold a different number of values for each of them. If there is
+    a deadband, the last "N" values are instead rebuilt on a regular
+    grid from the stored changes.
+
+    The windows are kept between cycles, and only the samples
+    recorded since the last cycle are read.
     """
-    from dfstat import myconfig, logger, db
+    from dfstat import myconfig, logger
+    global db, archive, windows, pool, forecast_db
 
     logger.debug("run_analysis")
-    seconds_ago =  myconfig.time_interval * myconfig.window_size
-    starttime = timestamp_to_sqlite(time.time() - seconds_ago)
-       
-    SQL = f"""
-        SELECT * from v_recent_measurements where measured_at > "{starttime}"
-        """
-    frame = db.execute_SQL(SQL)
-    for host_frame in [group for _, group in frame.groupby('host')]:
-        for partition_frame in ( group for _, group in host_frame.groupby('partition') ):
-            analyze_diskspace(partition_frame)
+
+    # With an archive, bring it up to date, so the windows of new
+    # series can be filled from it.
+    if archive is not None:
+        archive.update(db)
+
+    windows.refresh(db, db.targets, archive)
+    keys = [ key for key, w in windows.items() ]
+    columns = [ w.columns() for key, w in windows.items() ]
+    t, a = stack(columns, myconfig.window_size)
+
+    if forecast_db is not None:
+        forecast(keys, columns, t, a)
+
+    # Only the windows that pass the trend screen, computed for all
+    # of them at once, are tested. A window in which nothing changed
+    # never passes, because its last sample is not a drop.
+    keep = prescreen(t, a, myconfig.get('analysis', {}).get('trend_t', 0.0))
+    avails = [ c.avail_disk for c, k in zip(columns, keep) if k ]
+    logger.debug(f"{len(avails)} of {len(columns)} windows passed the trend screen")
+
+    # The windows are tested together, in one batch per worker; the 
+    # alerts are sent from here.
+    if pool is not None and avails:
+        workers = myconfig.analysis.workers
+        batches = [ avails[i::workers] for i in range(workers) ]
+        p_values = np.empty(len(avails))
+        for i, batch_p_values in enumerate(pool.map(stationarity, batches)):
+            p_values[i::workers] = batch_p_values
+    else:
+        p_values = stationarity(avails)
+
+    for avail_disk, p_value in zip(avails, p_values):
+        analyze_diskspace(avail_disk, p_value)
+
+@trap
+def forecast(keys:list, columns:list, t:np.ndarray, a:np.ndarray) -> None:
+    """
+    Estimate the hours until each partition is full, from the robust
+    trend of its window, for all of them at once. Store the forecasts,
+    and send an alert for each partition that will be full within 
+    alert_hours, the soonest first, at most once per message_repeat
+    seconds for each partition.
+    """
+    from dfstat import myconfig, logger
+    global forecast_db, alerted
+
+    config = myconfig.get('forecast', {})
+    last = np.array([ int(c.avail_disk[-1]) if len(c.avail_disk) else 0 for c in columns ])
+    hours, slope, avail_now = time_to_full(t, a, last, config.get('min_points', 3))
+    forecast_db.record_forecasts(
+        (host, partition, int(avail_now[i]), float(np.nan_to_num(slope[i])),
+            float(hours[i]) if np.isfinite(hours[i]) else None)
+        for i, (host, partition) in enumerate(keys) if len(columns[i].ts) )
+
+    now = time.time()
+    for i in np.argsort(hours):
+        if not hours[i] < config.get('alert_hours', 0): break
+        host, partition = keys[i]
+        if now - alerted.get(keys[i], 0) < myconfig.message_repeat: continue
+        alerted[keys[i]] = now
+        logger.info(f"{host}:{partition} will be full in {hours[i]:.1f} hours.")
+        send_email(f"{host}:{partition} will be full in {hours[i]:.0f} hours")
+
 
 @trap
 def timestamp_to_sqlite(t:int) -> str:
@@ -175,8 +272,29 @@ def timestamp_to_sqlite(t:int) -> str:
 
 @trap
 def dfanalysis_main(myargs:argparse.Namespace=None) -> int:
-    from dfstat import myconfig, logger, db
- 
+    from dfstat import myconfig, logger
+    global db, archive, windows, pool, forecast_db
+
+    db = DFStatsDB.reader(myconfig.database)
+    if myconfig.get('forecast', {}).get('alert_hours'):
+        forecast_db = DFStatsDB(myconfig.database)
+    if (directory := myconfig.get('archive', {}).get('directory')):
+        retention_config = myconfig.get('retention', {})
+        archive = Archive(directory, 
+            Retention(retention_config['days'], overrides=retention_config.get('keep', ()))
+            if retention_config.get('days') else None)
+
+    # With a deadband, the samples are irregular, and only the changes
+    # are stored; look at the series as if it were measured every step.
+    deadband = myconfig.get('deadband', {})
+    step = deadband.get('step', myconfig.time_interval) if deadband.get('heartbeat') else 0
+    windows = WindowCache(myconfig.window_size, step)
+
+    # The workers are forked when the pool is first used, from this
+    # process, which has only one thread.
+    if (workers := myconfig.get('analysis', {}).get('workers', 0)) > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+            mp_context=multiprocessing.get_context('fork'))
     send_email("love")
     print(f"{myconfig=} {logger=} {db=}")
 
@@ -194,6 +312,8 @@ def dfanalysis_main(myargs:argparse.Namespace=None) -> int:
     #logfile=f"{os.path.basename(__file__)[:-3]}.log" 
     #logger = URLogger(logfile=logfile, level=logging.DEBUG)
 
+    # Stay half an interval out of step with the polling. 
+    time.sleep(myconfig.time_interval / 2)
     while True:
         run_analysis()
         time.sleep(myconfig.time_interval)
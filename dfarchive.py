@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Archive keeps a copy of each series' good samples in columns, one
+append-only file of int64s per column, so that the analysis (and
+anyone studying the history) can memory-map them rather than query
+SQLite and build a DataFrame for every series.
+
+    {directory}/{host}/{partition, quoted}/ts.i8
+                                          /partition_size.i8
+                                          /avail_disk.i8
+
+The archive is brought up to date with the samples that have been
+stored since the last update, in the order they were stored (their
+seq). A sample that is newer than the series' last ts is appended;
+one that arrived late is merged in, and the series is written again.
+With a Retention, the samples older than the retention period are
+trimmed from the front of each series, once they make up 
+TRIM_FRACTION of it, so each sample is copied only a few times.
+
+archive = Archive('./archive')
+archive.update(db)
+columns = archive.read('spydur', '/scratch')
+"""
+import typing
+from   typing import *
+
+min_py = (3, 11)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+import contextlib
+import fcntl
+import shutil
+import time
+import tomllib
+import urllib.parse
+
+###
+# Installed libraries.
+###
+import numpy
+
+###
+# From hpclib
+###
+from   sloppytree import SloppyTree
+from   urdecorators import trap
+
+###
+# imports and objects that are a part of this project
+###
+from   dfdata import Columns, DFStatsDB, series_columns
+from   dfretain import Retention
+
+###
+# Global objects and initializations
+###
+verbose = False
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+###
+# ts is written last, so a column that is longer than ts was cut
+# short by a crash, and the extra values are ignored.
+###
+COLUMNS = ('avail_disk', 'partition_size', 'ts')
+DTYPE = numpy.dtype('<i8')
+
+###
+# A series is trimmed when this much of it is older than the retention
+# period. A trimmed copy is written beside the series, with a suffix
+# that a quoted partition name cannot have, and swapped in.
+###
+TRIM_FRACTION = 0.125
+NEW, OLD = '%new', '%old'
+
+###
+# The seq of the last sample in the archive is kept in SEQ_FILE, and
+# the samples after it are read BATCH_SIZE at a time.
+###
+SEQ_FILE = '.seq'
+BATCH_SIZE = 100000
+
+
+class Archive:
+
+    def __init__(self, directory:str, retention:Retention=None) -> None:
+        """
+        retention -- if given, how long to keep each series (see 
+            Retention.keep_days()). Without it, the archive keeps 
+            everything, and grows without bound.
+        """
+        self.directory = os.path.expanduser(directory)
+        self.retention = retention
+        os.makedirs(self.directory, exist_ok=True)
+
+
+    def path(self, host:str, partition:str, column:str='') -> str:
+        return os.path.join(self.directory, host,
+            urllib.parse.quote(partition, safe=''), column and f"{column}.i8")
+
+
+    def length(self, host:str, partition:str) -> int:
+        """
+        The number of complete samples in the archive.
+        """
+        try:
+            return min(os.path.getsize(self.path(host, partition, _)) for _ in COLUMNS) // DTYPE.itemsize
+        except FileNotFoundError as e:
+            return 0
+
+
+    def read(self, host:str, partition:str) -> dict:
+        """
+        The columns of the series, memory-mapped and read-only, as
+        {column : array}. The arrays are empty if nothing has been
+        archived.
+        """
+        n = self.length(host, partition)
+        return { _ : numpy.memmap(self.path(host, partition, _), dtype=DTYPE, mode='r', shape=(n,))
+            if n else numpy.empty(0, dtype=DTYPE) for _ in COLUMNS }
+
+
+    def columns(self, host:str, partition:str, window_size:int,
+            step:int=0, until:int=None) -> Columns:
+        """
+        What DFStatsDB.recent_arrays() (or, with a step, step_arrays())
+        would return, read from the archive. Without a step, the arrays
+        are views of the memory-mapped files.
+        """
+        columns = self.read(host, partition)
+        return series_columns(columns['ts'], columns['partition_size'], columns['avail_disk'],
+            window_size, step, until)
+
+
+    @contextlib.contextmanager
+    def locked(self) -> Generator:
+        """
+        Only one process at a time may append to the archive.
+        """
+        with open(os.path.join(self.directory, '.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+    def seq(self) -> int:
+        """
+        The seq of the last sample in the archive, or None if it is not
+        known.
+        """
+        try:
+            with open(os.path.join(self.directory, SEQ_FILE)) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError) as e:
+            return None
+
+
+    def set_seq(self, seq:int) -> None:
+        name = os.path.join(self.directory, SEQ_FILE)
+        with open(name + NEW, 'w') as f:
+            f.write(str(seq))
+        os.replace(name + NEW, name)
+
+
+    def add(self, host:str, partition:str, rows:list) -> int:
+        """
+        Add rows of (ts, size, avail), in any order, to the series.
+        If they all come after its last ts, they are appended; if not,
+        they are merged in, and they replace any samples with the same 
+        ts. Either way, adding the same rows again changes nothing.
+        """
+        if not rows: return 0
+
+        rows = sorted(rows)
+        columns = self.read(host, partition)
+        if not len(columns['ts']) or rows[0][0] > columns['ts'][-1]:
+            return self.append(host, partition, rows)
+
+        new = dict(zip(('ts', 'partition_size', 'avail_disk'),
+            (numpy.array(_, dtype=DTYPE) for _ in zip(*rows))))
+        keep = ~numpy.isin(columns['ts'], new['ts'])
+        order = numpy.argsort(numpy.concatenate([columns['ts'][keep], new['ts']]), kind='stable')
+        self.replace(host, partition, { column : 
+            numpy.concatenate([columns[column][keep], new[column]])[order] for column in COLUMNS })
+        return len(rows)
+
+
+    def append(self, host:str, partition:str, rows:list) -> int:
+        """
+        Add rows of (ts, size, avail) to the end of the series.
+        """
+        if not rows: return 0
+
+        ts, size, avail = (numpy.array(_, dtype=DTYPE) for _ in zip(*rows))
+        os.makedirs(self.path(host, partition), exist_ok=True)
+        n = self.length(host, partition) * DTYPE.itemsize
+        for column, values in zip(COLUMNS, (avail, size, ts)):
+            with open(self.path(host, partition, column), 'ab') as f:
+                f.truncate(n)
+                f.write(values.tobytes())
+        return len(rows)
+
+
+    def recover(self, host:str, partition:str) -> None:
+        """
+        Finish (or undo) a trim() that was interrupted.
+        """
+        here = self.path(host, partition).rstrip(os.sep)
+        if not os.path.exists(here) and os.path.isdir(here + NEW):
+            os.rename(here + NEW, here)
+        for leftover in (NEW, OLD):
+            shutil.rmtree(here + leftover, ignore_errors=True)
+
+
+    def trim(self, host:str, partition:str, cutoff:int) -> int:
+        """
+        Drop the samples from before cutoff (epoch seconds), if they
+        are at least TRIM_FRACTION of the series. The rest are copied 
+        to a new directory, which takes the place of the old one. 
+        Returns the number of samples dropped.
+        """
+        columns = self.read(host, partition)
+        n = len(columns['ts'])
+        i = int(numpy.searchsorted(columns['ts'], cutoff))
+        if not i or i < n * TRIM_FRACTION: return 0
+
+        self.replace(host, partition, { column : columns[column][i:] for column in COLUMNS })
+        return i
+
+
+    def replace(self, host:str, partition:str, columns:dict) -> None:
+        """
+        Write the columns to a new directory, which takes the place of
+        the series' directory. recover() finishes the job if it is
+        interrupted.
+        """
+        here = self.path(host, partition).rstrip(os.sep)
+        os.makedirs(here + NEW)
+        for column in COLUMNS:
+            with open(os.path.join(here + NEW, f"{column}.i8"), 'wb') as f:
+                f.write(numpy.asarray(columns[column], dtype=DTYPE).tobytes())
+        del columns
+
+        os.rename(here, here + OLD)
+        os.rename(here + NEW, here)
+        shutil.rmtree(here + OLD)
+
+
+    @trap
+    def update(self, db:DFStatsDB) -> int:
+        """
+        Add the samples of the targets that were stored since the last
+        update, and trim the series to the retention period. Returns
+        the number of samples added.
+
+        The seq is saved after each batch is written, so a crash can
+        only cause a batch to be added again, which changes nothing.
+        A new archive (or one made before there was a seq) is brought
+        up to date one series at a time, by ts, first; an old archive
+        may be missing samples that arrived late, and can be removed
+        to have it written again.
+        """
+        n = 0
+        now = time.time()
+        targets = { (host, partition) for host, partitions in db.targets.items()
+            for partition in partitions if partition.startswith('/') }
+        with self.locked():
+            for key in targets:
+                self.recover(*key)
+
+            if (seq := self.seq()) is None:
+                seq = db.last_seq()
+                for host, partition in targets:
+                    ts = self.read(host, partition)['ts']
+                    n += self.add(host, partition,
+                        db.samples_since(host, partition, int(ts[-1]) if len(ts) else -1))
+                self.set_seq(seq)
+
+            while (stored := db.stored_since(seq, BATCH_SIZE)):
+                rows = {}
+                for _, host, partition, ts, size, avail in stored:
+                    rows.setdefault((host, partition), []).append((ts, size, avail))
+                for key in targets & rows.keys():
+                    n += self.add(*key, rows[key])
+                seq = stored[-1][0]
+                self.set_seq(seq)
+
+            if self.retention is not None:
+                for host, partition in targets:
+                    self.trim(host, partition, 
+                        int(now - self.retention.keep_days(host, partition) * 86400))
+        return n
+
+
+@trap
+def dfarchive_main(myargs:argparse.Namespace) -> int:
+
+    with open(myargs.input, 'rb') as f:
+        myconfig = SloppyTree(tomllib.load(f))
+
+    db = DFStatsDB.reader(myconfig.database)
+    retention_config = myconfig.get('retention', {})
+    archive = Archive(myargs.directory or myconfig.get('archive', {}).get('directory', './archive'),
+        Retention(retention_config['days'], overrides=retention_config.get('keep', ()))
+        if retention_config.get('days') else None)
+    print(f"{archive.update(db)} samples added to {archive.directory}")
+    db.close()
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog="dfarchive",
+        description="Bring the columnar archive of the measurements up to date.")
+
+    parser.add_argument('-i', '--input', type=str, default="dfstat.toml",
+        help="toml file with the config info.")
+    parser.add_argument('-d', '--directory', type=str, default="",
+        help="Archive directory, if not the one in the config file.")
+
+    myargs = parser.parse_args()
+
+    try:
+        sys.exit(globals()[f"{os.path.basename(__file__)[:-3]}_main"](myargs))
+
+    except Exception as e:
+        print(f"Escaped or re-raised exception: {e}")
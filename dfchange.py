@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+ChangeDetector notices a sudden drop in the available space of a
+partition as the measurement is recorded, rather than at the next
+analysis cycle. Each series is watched by a Page-Hinkley test on the
+fraction of the partition that was used up since the last
+measurement. The state of a series is a handful of numbers, and each
+measurement updates it in constant time, without looking at the
+history. When the detector starts, the usual rates can be taken from
+the rollups, so that a restart does not leave it blind while it learns
+them again.
+
+detector = ChangeDetector(delta=0.001, threshold=0.01, alert=report)
+detector.seed(db.usual_rates(time.time() - 86400))
+writer = MeasurementWriter(myconfig.database, logger, detector=detector)
+"""
+import typing
+from   typing import *
+
+min_py = (3, 11)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+
+###
+# Installed libraries.
+###
+
+
+###
+# From hpclib
+###
+
+###
+# imports and objects that are a part of this project
+###
+
+
+###
+# Global objects and initializations
+###
+verbose = False
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+class Change(NamedTuple):
+    host: str
+    partition: str
+    size: int
+    avail_then: int
+    avail_now: int
+    since: float
+    ts: float
+
+
+class SeriesState:
+    """
+    The Page-Hinkley statistic of one series. x is the fraction of
+    the partition used since the last measurement. mean is the usual
+    x, which starts at rate and forgets at the rate alpha. A new 
+    measurement is tested against the mean before it is learned, and
+    a drop is not learned at all, so that a drop soon after the start
+    is not taken for the usual rate. cusum is the sum of 
+    x - mean - delta; it climbs only when space goes faster than 
+    usual, and the drop is the climb above its lowest point. base and
+    since are the available space and the time at the lowest point,
+    for the report.
+    """
+    __slots__ = ('avail', 'mean', 'cusum', 'lowest', 'base', 'since')
+
+    def __init__(self, avail:int, now:float, rate:float=0.0) -> None:
+        self.avail = avail
+        self.mean = rate
+        self.reset(now)
+
+
+    def reset(self, now:float) -> None:
+        self.cusum = 0.0
+        self.lowest = 0.0
+        self.base = self.avail
+        self.since = now
+
+
+class ChangeDetector:
+    """
+    A SeriesState for each (host, partition). The drops are measured
+    against the latest size, because the size of some file systems
+    (ZFS datasets, for one) moves with the space that is used.
+    """
+
+    def __init__(self, *,
+            delta:float=0.001,
+            threshold:float=0.01,
+            alpha:float=0.05,
+            alert:Callable=None) -> None:
+        """
+        delta -- a change in the rate of filling smaller than this
+            fraction of the partition per measurement is ignored.
+        threshold -- report a drop when more than this fraction of
+            the partition has gone beyond the usual rate.
+        alpha -- how quickly the usual rate is forgotten.
+        alert -- called with a Change for each drop. The statistic
+            starts over after each drop, so a drop that goes on
+            is reported again once it passes the threshold again.
+        """
+        self.delta = delta
+        self.threshold = threshold
+        self.alpha = alpha
+        self.alert = alert
+        self.series = {}
+        self.rates = {}
+
+
+    def seed(self, rates:Iterable) -> None:
+        """
+        rates -- (host, partition, rate): the usual rate of a series,
+            as the fraction of the partition used per measurement. A
+            series starts at its rate (or at 0, if it has none) when 
+            it is first measured.
+        """
+        self.rates.update(((host, partition), rate) for host, partition, rate in rates)
+
+
+    def update(self, measurements:Iterable) -> list:
+        """
+        measurements -- (host, partition, size, avail, ts), where
+            size is the capacity of the partition, not the space used.
+        Returns the Changes, after passing each one to alert().
+        """
+        changes = []
+        for host, partition, size, avail, now in measurements:
+            if (s := self.series.get((host, partition))) is None:
+                self.series[host, partition] = SeriesState(avail, now,
+                    self.rates.get((host, partition), 0.0))
+                continue
+            x = (s.avail - avail) / size if size > 0 else 0.0
+            s.avail = avail
+            s.cusum += x - s.mean - self.delta
+            if s.cusum < s.lowest:
+                s.lowest, s.base, s.since = s.cusum, avail, now
+
+            elif s.cusum - s.lowest > self.threshold:
+                changes.append(Change(host, partition, size, s.base, avail, s.since, now))
+                s.reset(now)
+                continue
+
+            s.mean += (x - s.mean) * self.alpha
+
+        if self.alert is not None:
+            for change in changes:
+                self.alert(change)
+        return changes
@@ -17,12 +17,17 @@ if sys.version_info < min_py:
 ###
 import argparse
 import collections
+from   collections.abc import Generator
 import contextlib
+import functools
 import getpass
+import sqlite3
+import time
 
 ###
 # Installed libraries like numpy, pandas, paramiko
 ###
+import numpy
 import pandas
 
 ###
@@ -57,21 +62,350 @@ __email__ = f'{mynetid}@richmond.edu'
 __status__ = 'in progress'
 __license__ = 'MIT'
 
+###
+# How long (in ms) a connection waits for another connection's lock
+# before giving up, and how many times we try again after that.
+###
+BUSY_TIMEOUT = 5000
+BUSY_RETRIES = 5
+
+###
+# The layout of the database, from dfstat.sql, that this code expects.
+# It is kept in PRAGMA user_version. The original layout (one df_stat
+# table with text keys and times) is version 0. In version 2, the
+# samples are stored by series id and epoch time. In version 3, 
+# partition_size is the size of the partition (before, it was the
+# space used on it), and the good samples are numbered in the order
+# they are stored. dfmigrate.py converts the older versions.
+###
+SCHEMA_VERSION = 3
+
+###
+# The columns of the frames from series_frame().
+###
+STEP_COLUMNS = ('host', 'partition', 'partition_size', 'avail_disk', 
+    'error_code', 'measured_at', 'ts')
+
+###
+# The rollup tables hold, for each series and each hour (or day), 
+# the count, min, max, sum, and last value of the measurements. They
+# are kept up to date as the measurements are recorded; a measurement
+# that arrives late does not replace a later one as the last value.
+###
+ROLLUP = """INSERT INTO {table}
+    (host, partition, period, n, 
+        min_avail, max_avail, sum_avail, last_avail,
+        min_size, max_size, sum_size, last_size, last_at)
+    VALUES (?1, ?2, strftime('{period}', ?5, 'unixepoch'), 1, 
+        ?4, ?4, ?4, ?4, ?3, ?3, ?3, ?3, datetime(?5, 'unixepoch'))
+    ON CONFLICT (host, partition, period) DO UPDATE SET
+        n = n + 1,
+        min_avail = min(min_avail, excluded.min_avail),
+        max_avail = max(max_avail, excluded.max_avail),
+        sum_avail = sum_avail + excluded.sum_avail,
+        last_avail = iif(excluded.last_at >= last_at, excluded.last_avail, last_avail),
+        min_size = min(min_size, excluded.min_size),
+        max_size = max(max_size, excluded.max_size),
+        sum_size = sum_size + excluded.sum_size,
+        last_size = iif(excluded.last_at >= last_at, excluded.last_size, last_size),
+        last_at = max(last_at, excluded.last_at)
+    """
+
+###
+# The last values of each period are taken from the row numbered 1,
+# the latest; a bare column beside several aggregates could come from
+# any row.
+###
+ROLLUP_BACKFILL = """INSERT OR REPLACE INTO {table}
+    SELECT host, partition, period, count(*),
+        min(avail_disk), max(avail_disk), sum(avail_disk), max(avail_disk) FILTER (WHERE k = 1),
+        min(partition_size), max(partition_size), sum(partition_size), 
+        max(partition_size) FILTER (WHERE k = 1),
+        max(measured_at)
+    FROM (SELECT host, partition, avail_disk, partition_size, measured_at,
+            strftime('{period}', measured_at) AS period,
+            row_number() OVER (PARTITION BY series_id, strftime('{period}', measured_at) 
+                ORDER BY ts DESC) AS k
+        FROM df_stat WHERE error_code = 0)
+    GROUP BY host, partition, period
+    """
+
+ROLLUPS = {
+    'hourly' : ('df_stat_hourly', '%Y-%m-%d %H:00:00'),
+    'daily' : ('df_stat_daily', '%Y-%m-%d 00:00:00')
+    }
+
+###
+# Databases made before there were rollups do not have these. A writer
+# that opens such a database creates them, and fills them in from
+# the samples.
+###
+ROLLUP_TABLES = """
+CREATE TABLE IF NOT EXISTS {table}(
+    host varchar(32),
+    partition varchar(32),
+    period datetime,
+    n int,
+    min_avail int,
+    max_avail int,
+    sum_avail int,
+    last_avail int,
+    min_size int,
+    max_size int,
+    sum_size int,
+    last_size int,
+    last_at datetime,
+    PRIMARY KEY (host, partition, period));
+
+CREATE VIEW IF NOT EXISTS v_{name} as SELECT host, partition, period, n,
+    min_avail, max_avail, 1.0 * sum_avail / n as mean_avail, last_avail,
+    min_size, max_size, 1.0 * sum_size / n as mean_size, last_size
+    FROM {table};
+"""
+
+###
+# current_state has one row per series: its last good measurement, 
+# and the host's last error in the host's ERROR row. It is kept up 
+# to date in the same transaction as the samples, so "what is every
+# partition at right now" is a primary key lookup. It is created 
+# (and filled from the samples) the first time a writer opens a
+# database that does not have it.
+###
+CURRENT_STATE = """
+CREATE TABLE IF NOT EXISTS current_state(
+    host varchar(32),
+    partition varchar(32),
+    ts int,
+    partition_size int,
+    avail_disk int,
+    error_code int DEFAULT 0,
+    error_ts int,
+    PRIMARY KEY (host, partition)) WITHOUT ROWID;
+
+CREATE VIEW IF NOT EXISTS v_current as SELECT host, partition, 
+    partition_size, avail_disk, datetime(ts, 'unixepoch') as measured_at,
+    error_code, datetime(error_ts, 'unixepoch') as error_at,
+    CAST(strftime('%s', 'now') as int) - ts as since_success
+    FROM current_state;
+"""
+
+CURRENT_STATE_BACKFILL = (
+    """INSERT OR REPLACE INTO current_state 
+        (host, partition, ts, partition_size, avail_disk)
+        SELECT series.host, series.partition, max(ts), partition_size, avail_disk
+        FROM samples JOIN series USING (series_id) 
+        WHERE error_code = 0 AND series.partition != 'ERROR' GROUP BY series_id""",
+    """INSERT INTO current_state (host, partition, error_code, error_ts)
+        SELECT series.host, series.partition, error_code, max(ts)
+        FROM samples JOIN series USING (series_id) 
+        WHERE error_code != 0 GROUP BY series_id
+        ON CONFLICT (host, partition) DO UPDATE SET 
+            error_code = excluded.error_code, error_ts = excluded.error_ts"""
+    )
+
+###
+# forecasts has one row per series: how fast it is filling, and how
+# many hours it has left, as of the analyzer's last cycle. Like
+# current_state, it is created when a writer first opens a database
+# that does not have it.
+###
+FORECASTS = """
+CREATE TABLE IF NOT EXISTS forecasts(
+    host varchar(32),
+    partition varchar(32),
+    ts int,
+    avail_disk int,
+    slope real,
+    hours_to_full real,
+    PRIMARY KEY (host, partition)) WITHOUT ROWID;
+
+CREATE VIEW IF NOT EXISTS v_forecasts as SELECT host, partition,
+    datetime(ts, 'unixepoch') as forecast_at, avail_disk, 
+    slope as blocks_per_hour, hours_to_full,
+    datetime(ts + 3600 * hours_to_full, 'unixepoch') as full_at
+    FROM forecasts WHERE hours_to_full IS NOT NULL ORDER BY hours_to_full;
+"""
 
 SQL = SloppyTree({
     'initial': """INSERT INTO hosts (host, partition) values (?, ?)""",
-    'cleanup' : """
-        DELETE FROM df_stat WHERE rowid NOT IN 
-            (SELECT rowid FROM v_recent_measurements)
+    'prune' : """
+        DELETE FROM samples WHERE series_id = ?1 AND ts IN 
+            (SELECT ts FROM samples 
+                WHERE series_id = ?1 AND ts < CAST(strftime('%s', ?2) as int) 
+                ORDER BY ts LIMIT ?3)
         """,
-    'error' : """INSERT INTO df_stat (host, error_code) VALUES (?, ?)""",
+    'series_id' : """SELECT series_id FROM series WHERE host = ? AND partition = ?""",
+    'error' : """INSERT OR REPLACE INTO samples (series_id, ts, error_code) 
+        SELECT series_id, ?3, ?2 
+        FROM series WHERE host = ?1 AND partition = 'ERROR'""",
     'recent' : """SELECT * FROM v_recent_measurements LIMIT ?""",
     'recent_by_host' : """SELECT * FROM v_recent_measurements WHERE host=? LIMIT ?""",
-    'targets' : """SELECT * FROM v_hosts""",
-    'measurement' : """INSERT INTO df_stat 
-        (host, partition, partition_size, avail_disk ) VALUES (?, ?, ?, ?)"""
+    'recent_by_series' : """SELECT * FROM 
+        (SELECT * FROM df_stat WHERE host=? AND partition=? 
+            ORDER BY ts DESC LIMIT ?)
+        ORDER BY ts""",
+    'old_layout' : """SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'df_stat'""",
+    'targets' : """SELECT host, partition FROM v_hosts""",
+    'measurement' : """INSERT OR REPLACE INTO samples 
+        (series_id, ts, partition_size, avail_disk, seq) 
+        SELECT series_id, ?5, ?3, ?4, (SELECT coalesce(max(seq), 0) + 1 FROM samples)
+        FROM series WHERE host = ?1 AND partition = ?2""",
+    'current_measurement' : """INSERT INTO current_state 
+        (host, partition, ts, partition_size, avail_disk) 
+        VALUES (?1, ?2, ?5, ?3, ?4)
+        ON CONFLICT (host, partition) DO UPDATE SET
+            ts = excluded.ts,
+            partition_size = excluded.partition_size,
+            avail_disk = excluded.avail_disk
+        WHERE excluded.ts >= coalesce(current_state.ts, 0)""",
+    'current_error' : """INSERT INTO current_state 
+        (host, partition, error_code, error_ts) 
+        VALUES (?1, 'ERROR', ?2, ?3)
+        ON CONFLICT (host, partition) DO UPDATE SET
+            error_code = excluded.error_code,
+            error_ts = excluded.error_ts
+        WHERE excluded.error_ts >= coalesce(current_state.error_ts, 0)""",
+    'current' : """SELECT * FROM v_current""",
+    'last_good' : """SELECT coalesce(
+        (SELECT ts FROM current_state WHERE host = ?1 AND partition = ?2),
+        (SELECT max(ts) FROM df_stat WHERE host = ?1 AND partition = ?2))""",
+    'recent_samples' : """SELECT * FROM 
+        (SELECT ts, partition_size, avail_disk FROM samples
+            WHERE series_id = (SELECT series_id FROM series WHERE host = ? AND partition = ?)
+                AND error_code = 0
+            ORDER BY ts DESC LIMIT ?)
+        ORDER BY ts""",
+    'samples_since' : """SELECT ts, partition_size, avail_disk FROM samples
+        WHERE series_id = (SELECT series_id FROM series WHERE host = ? AND partition = ?)
+            AND ts > ? AND error_code = 0
+        ORDER BY ts""",
+    'last_seq' : """SELECT coalesce(max(seq), 0) FROM samples""",
+    'stored_since' : """SELECT seq, host, partition, ts, partition_size, avail_disk 
+        FROM samples JOIN series USING (series_id)
+        WHERE seq > ? ORDER BY seq LIMIT ?""",
+    'step_series' : """SELECT ts, partition_size, avail_disk FROM samples
+        WHERE series_id = (SELECT series_id FROM series WHERE host = ?1 AND partition = ?2)
+            AND ts >= coalesce((SELECT max(ts) FROM samples WHERE ts <= ?3 AND error_code = 0
+                AND series_id = (SELECT series_id FROM series WHERE host = ?1 AND partition = ?2)), ?3)
+            AND ts <= ?4 AND error_code = 0
+        ORDER BY ts""",
+    'usual_rates' : """WITH recent AS (SELECT host, partition, n, last_avail,
+            row_number() OVER (PARTITION BY host, partition ORDER BY period) AS k
+        FROM df_stat_hourly WHERE period >= strftime('%Y-%m-%d %H:00:00', ?1, 'unixepoch'))
+        SELECT host, partition, coalesce(max(0.0, 1.0 * (max(last_avail) FILTER (WHERE k = 1) - c.avail_disk)
+                / c.partition_size / sum(n) FILTER (WHERE k > 1)), 0.0)
+        FROM current_state c JOIN recent USING (host, partition)
+        WHERE partition <> 'ERROR' AND c.partition_size > 0
+        GROUP BY host, partition""",
+    'current_by_host' : """SELECT * FROM v_current WHERE host = ?""",
+    'current_by_series' : """SELECT * FROM v_current WHERE host = ? AND partition = ?""",
+    'has_table' : """SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?""",
+    'forecast' : """INSERT OR REPLACE INTO forecasts 
+        (host, partition, ts, avail_disk, slope, hours_to_full) 
+        VALUES (?, ?, CAST(strftime('%s', 'now') as int), ?, ?, ?)""",
+    'forecasts' : """SELECT * FROM v_forecasts LIMIT ?""",
+    'rollup' : { k : ROLLUP.format(table=table, period=period) 
+        for k, (table, period) in ROLLUPS.items() },
+    'rollup_backfill' : { k : ROLLUP_BACKFILL.format(table=table, period=period) 
+        for k, (table, period) in ROLLUPS.items() },
+    'history' : { k : f"""SELECT * FROM v_{k} 
+        WHERE host = ? AND partition = ? AND period >= ? ORDER BY period"""
+        for k in ROLLUPS }
     })
 
+class Columns(NamedTuple):
+    """
+    One series, oldest first, as int64 arrays.
+    """
+    ts: numpy.ndarray
+    partition_size: numpy.ndarray
+    avail_disk: numpy.ndarray
+
+
+def columns_from(rows:list) -> Columns:
+    """
+    Rows of (ts, size, avail), as they come from the cursor, turned
+    into contiguous arrays without going through pandas.
+    """
+    if not rows:
+        return Columns(*(numpy.empty(0, dtype=numpy.int64) for _ in range(3)))
+    return Columns(*numpy.array(rows, dtype=numpy.int64).T.copy())
+
+
+def series_columns(ts:Sequence, size:Sequence, avail:Sequence,
+        window_size:int, step:int=0, until:int=None) -> Columns:
+    """
+    Without a step, the last window_size samples; for arrays, these
+    are views rather than copies. With a step, the series as if it
+    had been measured every step seconds, window_size times, up to
+    until (by default the last sample): each row has the last values
+    at or before its time.
+    """
+    ts, size, avail = (numpy.asarray(_, dtype=numpy.int64) for _ in (ts, size, avail))
+    if not step or not len(ts):
+        return Columns(ts[-window_size:], size[-window_size:], avail[-window_size:])
+
+    until = ts[-1] if until is None else until
+    grid = int(until) - (window_size - 1) * step + step * numpy.arange(window_size, dtype=numpy.int64)
+    grid = grid[grid >= ts[0]]
+    i = numpy.searchsorted(ts, grid, side='right') - 1
+    return Columns(grid, size[i], avail[i])
+
+
+def series_frame(host:str, partition:str, 
+        ts:Sequence, size:Sequence, avail:Sequence,
+        window_size:int, step:int=0, until:int=None) -> pandas.DataFrame:
+    """
+    A frame like the ones from recent_records(), from the columns of
+    a series, oldest first; see series_columns().
+    """
+    columns = series_columns(ts, size, avail, window_size, step, until)
+    return pandas.DataFrame({
+        'host' : host, 
+        'partition' : partition, 
+        'partition_size' : columns.partition_size, 
+        'avail_disk' : columns.avail_disk, 
+        'error_code' : 0,
+        'measured_at' : pandas.to_datetime(columns.ts, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+        'ts' : columns.ts
+        }, columns=STEP_COLUMNS)
+
+
+def without_series(cursor:sqlite3.Cursor, rows:Sequence, keys:Iterable) -> list:
+    """
+    The rows whose (host, partition) key has no series, and so were
+    not written to samples.
+    """
+    known = {}
+    missing = []
+    for row, key in zip(rows, keys):
+        if key not in known:
+            known[key] = cursor.execute(SQL.series_id, key).fetchone() is not None
+        if not known[key]:
+            missing.append(row)
+    return missing
+
+
+def retry_on_busy(f:Callable) -> Callable:
+    """
+    Try again, waiting a little longer each time, when the database
+    is still locked after the busy timeout has run out.
+    """
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs) -> object:
+        delay = 0.1
+        for attempt in range(BUSY_RETRIES):
+            try:
+                return f(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if ('locked' not in str(e) and 'busy' not in str(e) or
+                        attempt == BUSY_RETRIES - 1):
+                    raise
+                time.sleep(delay)
+                delay *= 2
+    return wrapper
+
+
 class DFStatsDB(SQLiteDB):
     pass
 
@@ -87,37 +421,344 @@ class DFStatsDB(SQLiteDB):
         self.db = sqlitedb.SQLiteDB(db_name)
     '''
 
-    def cleanup(self, window_size:int) -> int:
-        return self.db.execute_SQL(SQL.cleanup)
+    def __init__(self, db_name:str, *, 
+            read_only:bool=False, 
+            busy_timeout:int=BUSY_TIMEOUT) -> None:
+        """
+        Writers put the database in WAL mode, so that readers do not
+        block the writer, and the writer does not block readers.
 
+        A database with the original layout must be converted with
+        dfmigrate.py before it can be used.
+        """
+        super().__init__(db_name)
+        self.db.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION and (version or self.db.execute(SQL.old_layout).fetchone()):
+            raise sqlite3.DatabaseError(
+                f"{db_name} has the version {version} layout. Run dfmigrate.py on it first.")
 
+        if read_only:
+            self.db.execute("PRAGMA query_only = ON")
+        else:
+            self.db.execute("PRAGMA journal_mode = WAL")
+            self.db.execute("PRAGMA synchronous = NORMAL")
+            if not all(self.db.execute(SQL.has_table, (table,)).fetchone() 
+                    for table, period in ROLLUPS.values()):
+                self.db.executescript("".join(ROLLUP_TABLES.format(name=name, table=table)
+                    for name, (table, period) in ROLLUPS.items()))
+                self.rollup_backfill()
+            if not self.db.execute(SQL.has_table, ('current_state',)).fetchone():
+                self.current_state_backfill()
+            if not self.db.execute(SQL.has_table, ('forecasts',)).fetchone():
+                self.db.executescript(FORECASTS)
+
+
+    @classmethod
+    def reader(cls, db_name:str, **kwargs) -> 'DFStatsDB':
+        """
+        A connection that can only read. Open it in the process (and
+        the thread) that will use it, i.e., after any fork; a SQLite
+        connection must not be shared with a child process.
+        """
+        return cls(db_name, read_only=True, **kwargs)
+
+
+    @retry_on_busy
+    def prune(self, host:str, partition:str, cutoff:str, batch_size:int) -> int:
+        """
+        Delete up to batch_size of the series' rows that were measured
+        before cutoff. Returns the number deleted; fewer than 
+        batch_size means there are no more.
+        """
+        with self.transaction() as cursor:
+            if not (row := cursor.execute(SQL.series_id, (host, partition)).fetchone()):
+                return 0
+            cursor.execute(SQL.prune, (row[0], cutoff, batch_size))
+            return cursor.rowcount
+
+
+    def incremental_vacuum(self, pages:int) -> None:
+        """
+        Return up to this many free pages to the file system. This
+        does nothing unless the database was created with
+        auto_vacuum = INCREMENTAL.
+        """
+        self.db.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+
+
+    @retry_on_busy
     def recent_records(self, host:str, partition:str, window_size:int) -> pandas.DataFrame:
         """
-        Get the recent data for the statistical analysis.
+        Get the recent data for the statistical analysis. For one
+        series, these are its last window_size rows, oldest first,
+        read in the order of the (series_id, ts) key, so the cost
+        depends on the window rather than on the size of the table.
+        Use 'all' for the host or partition to get everything.
+        """
+        if host == 'all':
+            return self.execute_SQL(SQL.recent, window_size)
+        elif partition == 'all':
+            return self.execute_SQL(SQL.recent_by_host, host, window_size)
+        else:
+            return self.execute_SQL(SQL.recent_by_series, host, partition, window_size)
+
+
+    @retry_on_busy
+    def recent_arrays(self, host:str, partition:str, window_size:int) -> Columns:
+        """
+        The series' last window_size good samples, oldest first, as 
+        arrays read straight from the cursor.
+        """
+        return columns_from(self.db.execute(SQL.recent_samples, 
+            (host, partition, window_size)).fetchall())
+
+
+    @retry_on_busy
+    def step_arrays(self, host:str, partition:str, window_size:int, 
+            step:int, until:int=None) -> Columns:
+        """
+        The series as if it had been measured every step seconds, 
+        window_size times, up to until (by default, its last good
+        measurement): each row has the last stored values at or 
+        before its time. This is what the analysis needs when 
+        the samples are stored with a Deadband.
         """
-        return ( self.db.execute_SQL(SQL.recent, window_size)
-            if host == 'all' else 
-            self.db.execute_SQL(SQL.recent_by_host, host, window_size) )
+        if until is None:
+            until = self.last_good(host, partition)
+        if until is None:
+            return columns_from(())
 
+        return series_columns(*self.step_rows(host, partition, window_size, step, until), 
+            window_size, step, until)
 
-    def record_error(self, host:str, code:int) -> int:
-        return self.db.execute_SQL(SQL.error, host, code)
+
+    def step_rows(self, host:str, partition:str, window_size:int, 
+            step:int, until:int) -> Columns:
+        """
+        The stored good samples that step_arrays() is made from: the 
+        ones up to until, from the last one at or before the start of
+        the window.
+        """
+        start = int(until) - (window_size - 1) * step
+        return columns_from(self.db.execute(SQL.step_series, 
+            (host, partition, start, until)).fetchall())
+
+
+    def step_series(self, host:str, partition:str, window_size:int, 
+            step:int, until:int=None) -> pandas.DataFrame:
+        """
+        step_arrays() as a frame, with the same columns as the ones 
+        from recent_records().
+        """
+        columns = self.step_arrays(host, partition, window_size, step, until)
+        return series_frame(host, partition, *columns, window_size)
+
+
+    def last_good(self, host:str, partition:str) -> int:
+        """
+        The time (epoch seconds) of the series' last good measurement,
+        or None.
+        """
+        return self.db.execute(SQL.last_good, (host, partition)).fetchone()[0]
+
+
+    @retry_on_busy
+    def usual_rates(self, since:int) -> list:
+        """
+        (host, partition, rate) for each series measured since then
+        (epoch seconds): the fraction of the partition used per 
+        measurement from the first hour in the hourly rollup to the
+        last measurement, or 0 if space was freed. This is what
+        ChangeDetector.seed() takes.
+        """
+        return self.db.execute(SQL.usual_rates, (int(since),)).fetchall()
+
+
+    def last_seq(self) -> int:
+        """
+        The seq of the last good sample stored, or 0.
+        """
+        return self.db.execute(SQL.last_seq).fetchone()[0]
+
+
+    @retry_on_busy
+    def stored_since(self, seq:int, limit:int) -> list:
+        """
+        The next limit good samples (seq, host, partition, ts, size, 
+        avail) of all the series, in the order they were stored after
+        the one numbered seq. Unlike samples_since(), this includes 
+        the ones that arrived after a later ts of their series.
+        """
+        return self.db.execute(SQL.stored_since, (seq, limit)).fetchall()
+
+
+    @retry_on_busy
+    def samples_since(self, host:str, partition:str, ts:int) -> list:
+        """
+        The series' good samples (ts, size, avail) after ts, oldest 
+        first, as they come from the cursor.
+        """
+        return self.db.execute(SQL.samples_since, (host, partition, ts)).fetchall()
+
+
+    @contextlib.contextmanager
+    def transaction(self) -> Generator:
+        """
+        Everything done with the cursor inside the with block is 
+        committed together, or not at all.
+        """
+        cursor = self.db.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+        except:
+            self.db.rollback()
+            raise
+        else:
+            self.db.commit()
+
+
+    def record_error(self, host:str, code:int, ts:int=None) -> int:
+        return self.record_round((), [(host, code, int(time.time()) if ts is None else ts)])
 
 
     def record_measurement(self,
             host:str, 
             partition:Iterable, 
             size:Iterable, 
-            free:Iterable) -> int:
+            free:Iterable,
+            ts:int=None) -> int:
         """
-        Record one or more measurements. We will use size as the sentinel
-        to determine whether we are recording one or more.
+        Record one or more measurements, made at ts (epoch seconds; by
+        default, now). We will use size as the sentinel to determine
+        whether we are recording one or more.
         """
+        ts = int(time.time()) if ts is None else ts
         if isinstance(size, int):
-            return self.db.execute_SQL(SQL.measurement, host, partition, size, free)
+            return self.record_round([(host, partition, size, free, ts)])
         else:
-            return self.db.executemany_SQL(SQL.measurement, 
-                zip(host, partition, size, free))
+            return self.record_round([ (*_, ts) for _ in zip(host, partition, size, free) ])
+
+
+    @retry_on_busy
+    def record_round(self, measurements:Iterable, errors:Iterable=(), 
+            samples:Iterable=None, unmatched:list=None) -> int:
+        """
+        Record all the measurements (host, partition, size, free, ts)
+        and errors (host, code, ts) from one polling round in one 
+        transaction, so there is one commit per round rather than one
+        per row. size is the capacity of the partition, and ts is 
+        when the measurement was made, in epoch seconds, so 
+        measurements that wait in the writer's queue keep their own
+        times.
+        The hourly and daily rollups, and current_state, are updated 
+        in the same transaction.
+
+        samples, if given, are the measurements that get a row in 
+        samples (see Deadband); the rollups and current_state are
+        updated from all of them.
+
+        A row whose series does not exist (such as an error from a 
+        host with no ERROR partition) is skipped, rather than costing
+        the rest of the round. If unmatched is a list, these rows are
+        added to it once the round is committed, so that a retry (see
+        retry_on_busy) does not add them twice.
+        """
+        measurements = list(measurements)
+        samples = measurements if samples is None else list(samples)
+        errors = list(errors)
+        skipped = []
+        with self.transaction() as cursor:
+            cursor.executemany(SQL.measurement, samples)
+            n = cursor.rowcount
+            if n < len(samples):
+                skipped.extend(without_series(cursor, samples, 
+                    (_[:2] for _ in samples)))
+            for rollup in SQL.rollup.values():
+                cursor.executemany(rollup, measurements)
+            cursor.executemany(SQL.current_measurement, measurements)
+            cursor.executemany(SQL.error, errors)
+            n += (written := cursor.rowcount)
+            if written < len(errors):
+                skipped.extend(without_series(cursor, errors, 
+                    ((_[0], 'ERROR') for _ in errors)))
+            cursor.executemany(SQL.current_error, errors)
+
+        if unmatched is not None:
+            unmatched.extend(skipped)
+        return n
+
+
+    def rollup_backfill(self) -> None:
+        """
+        Rebuild the rollups from whatever is in df_stat. This is only
+        needed once, for a database that has measurements from before
+        there were rollups; it is done when a writer creates the rollup
+        tables, and by dfmigrate.py --rollups. It replaces the rollups 
+        for every period that still has measurements in df_stat. (The
+        samples that a Deadband did not store are not counted.)
+        """
+        with self.transaction() as cursor:
+            for backfill in SQL.rollup_backfill.values():
+                cursor.execute(backfill)
+
+
+    def current_state_backfill(self) -> None:
+        """
+        Create current_state, and fill it in from the samples. 
+        """
+        self.db.executescript(CURRENT_STATE)
+        with self.transaction() as cursor:
+            for backfill in CURRENT_STATE_BACKFILL:
+                cursor.execute(backfill)
+
+
+    @retry_on_busy
+    def current(self, host:str='all', partition:str='all') -> pandas.DataFrame:
+        """
+        The latest state of every series: the last good measurement,
+        when it was made, and the seconds since then (since_success).
+        The host's last error is in its ERROR partition. Use 'all' 
+        for the host or partition, as in recent_records().
+        """
+        if host == 'all':
+            return self.execute_SQL(SQL.current)
+        elif partition == 'all':
+            return self.execute_SQL(SQL.current_by_host, host)
+        else:
+            return self.execute_SQL(SQL.current_by_series, host, partition)
+
+
+    @retry_on_busy
+    def record_forecasts(self, forecasts:Iterable) -> int:
+        """
+        Replace the forecasts of the series with these rows of (host,
+        partition, avail, slope, hours_to_full). A partition that is 
+        not filling has None for its hours.
+        """
+        with self.transaction() as cursor:
+            cursor.executemany(SQL.forecast, forecasts)
+            return cursor.rowcount
+
+
+    @retry_on_busy
+    def forecasts(self, limit:int=-1) -> pandas.DataFrame:
+        """
+        The partitions that are filling, the soonest to be full first.
+        """
+        return self.execute_SQL(SQL.forecasts, limit)
+
+
+    @retry_on_busy
+    def history(self, host:str, partition:str, since:str, 
+            granularity:str='hourly') -> pandas.DataFrame:
+        """
+        The rollups for one series since a time, for looking at a long
+        stretch of time without reading the measurements themselves.
+        granularity is hourly or daily.
+        """
+        return self.execute_SQL(SQL.history[granularity], host, partition, since)
 
     
     def populate_db(self, sql_statements_file):
@@ -130,27 +771,26 @@ class DFStatsDB(SQLiteDB):
             print(sql_statements)
             for statement in sql_statements: 
                 print(statement)
-                self.db.execute_SQL(statement) 
+                self.execute_SQL(statement) 
 
     def initial(self, host, partition):
         """
         Execute insert statements.        
         """
-        self.db.execute_SQL(SQL.initial, host, partition)
+        self.execute_SQL(SQL.initial, host, partition)
 
 
     @property
+    @retry_on_busy
     def targets(self) -> dict:
         """
         Get a list of everything we need to monitor. For maximum
         ease of querying the target computers, the data are
         returned with host as the key and a tuple of partitions
-        as the value.
+        as the value. They are read straight from the cursor;
+        there is no need for a DataFrame.
         """
-        data = self.db.execute_SQL(SQL.targets)
         organized_data = collections.defaultdict(list)
-        for k, v in ( row for row in data.itertuples(index=False) ):
-            organized_data[k].append(v)
-        return organized_data
-        
-
+        for host, partition in self.db.execute(SQL.targets):
+            organized_data[host].append(partition)
+        return { host : tuple(partitions) for host, partitions in organized_data.items() }
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Deadband decides which measurements are worth a row in samples. Most
+partitions hardly change from one poll to the next, so a measurement
+is stored only when the space has moved by more than the band since
+the last stored measurement of the series, or when heartbeat seconds
+have passed. The rollups and current_state still see every
+measurement; DFStatsDB.step_series() fills in the gaps for analysis.
+
+deadband = Deadband(absolute=1048576, relative=0.001, heartbeat=21600)
+writer = MeasurementWriter(myconfig.database, logger, deadband=deadband)
+"""
+import typing
+from   typing import *
+
+min_py = (3, 11)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+
+###
+# Installed libraries.
+###
+
+
+###
+# From hpclib
+###
+
+###
+# imports and objects that are a part of this project
+###
+
+
+###
+# Global objects and initializations
+###
+verbose = False
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+class Deadband:
+    """
+    The last stored (time, size, avail) of each (host, partition).
+    After a restart, the first measurement of each series is stored.
+    """
+
+    def __init__(self, *,
+            absolute:int=0,
+            relative:float=0.0,
+            heartbeat:float=21600) -> None:
+        """
+        absolute -- store the measurement if the size or the available
+            space has changed by more than this many (1K) blocks ...
+        relative -- ... or by more than this fraction of the size of
+            the partition (its capacity, not the space used) ...
+        heartbeat -- ... or if the last one stored is this many
+            seconds old.
+        """
+        self.absolute = absolute
+        self.relative = relative
+        self.heartbeat = heartbeat
+        self.last = {}
+
+
+    def band(self, size:int) -> float:
+        """
+        The smallest change that is stored, for a partition of this 
+        size.
+        """
+        bands = [ _ for _ in (self.absolute, self.relative * size) if _ > 0 ]
+        return min(bands) if bands else 0
+
+
+    def select(self, measurements:Iterable) -> list:
+        """
+        The measurements (host, partition, size, avail, ts) that are to
+        be stored. Nothing is remembered until stored() is called, so
+        that a failed write does not leave a gap wider than the band.
+        """
+        last = {}
+        keep = []
+        for m in measurements:
+            key = m[:2]
+            then = last.get(key) or self.last.get(key)
+            if (then is None or m[4] - then[0] >= self.heartbeat or
+                    max(abs(m[2] - then[1]), abs(m[3] - then[2])) > self.band(m[2])):
+                keep.append(m)
+                last[key] = (m[4], m[2], m[3])
+        return keep
+
+
+    def stored(self, measurements:Iterable) -> None:
+        for host, partition, size, avail, ts in measurements:
+            self.last[host, partition] = (ts, size, avail)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+The KPSS test for trend stationarity (statsmodels' kpss() with
+regression='ct' and nlags='auto'), for many series of the same length
+at once. Each row of the matrix is a series, oldest first.
+
+stat, p_value, lags = kpss_ct(numpy.vstack(windows))
+
+Run this file to check it against statsmodels, if statsmodels is
+installed, and to time the two.
+"""
+import typing
+from   typing import *
+
+min_py = (3, 11)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+import timeit
+import warnings
+
+###
+# Installed libraries.
+###
+import numpy
+
+###
+# From hpclib
+###
+
+###
+# imports and objects that are a part of this project
+###
+
+###
+# Global objects and initializations
+###
+verbose = False
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+###
+# Table 1 of Kwiatkowski et al. (1992), for the trend stationary
+# case. The p-values between them are interpolated, and the ones
+# outside them are clipped to 0.10 and 0.01.
+###
+CRITICAL_VALUES = numpy.array([0.119, 0.146, 0.176, 0.216])
+P_VALUES = numpy.array([0.10, 0.05, 0.025, 0.01])
+
+
+def autocovariances(resids:numpy.ndarray, lags:int) -> numpy.ndarray:
+    """
+    Column i is the sum of resids[t] * resids[t - i] over t, for each
+    row, for i in 0 .. lags.
+    """
+    nobs = resids.shape[1]
+    products = numpy.zeros((resids.shape[0], lags + 1))
+    for i in range(min(lags, nobs - 1) + 1):
+        products[:, i] = numpy.einsum('ij,ij->i', resids[:, i:], resids[:, :nobs - i])
+    return products
+
+
+def kpss_ct(x:numpy.ndarray) -> tuple:
+    """
+    x -- one series, or a matrix with a series in each row.
+    Returns the arrays (statistic, p-value, lags), one value for each
+    row. A row that is a straight line has nan for its statistic and
+    p-value.
+    """
+    x = numpy.atleast_2d(numpy.asarray(x, dtype=float))
+    nobs = x.shape[1]
+
+    # The residuals of the least squares line through each row.
+    t = numpy.arange(1, nobs + 1) - (nobs + 1) / 2
+    centered = x - x.mean(axis=1, keepdims=True)
+    resids = centered - numpy.outer(centered @ t / (t @ t), t)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        # The lags, by the method of Hobijn et al. (1998).
+        covlags = int(numpy.power(nobs, 2.0 / 9.0))
+        products = autocovariances(resids, covlags)
+        i = numpy.arange(1, covlags + 1)
+        s0 = products[:, 0] / nobs + products[:, 1:].sum(axis=1) / (nobs / 2.0)
+        s1 = (products[:, 1:] * i).sum(axis=1) / (nobs / 2.0)
+        gamma = 1.1447 * numpy.power((s1 / s0) ** 2, 1.0 / 3.0)
+        lags = numpy.minimum(numpy.nan_to_num(gamma * numpy.power(nobs, 1.0 / 3.0)).astype(int), nobs - 1)
+
+        # The long run variance, with the Bartlett kernel, eq. 10.
+        products = autocovariances(resids, int(lags.max(initial=0)))
+        i = numpy.arange(products.shape[1])
+        weights = numpy.where(i <= lags[:, None], 1.0 - i / (lags[:, None] + 1.0), 0.0)
+        weights[:, 0] = 0.5
+        s_hat = 2 * (products * weights).sum(axis=1) / nobs
+
+        # eq. 11
+        eta = numpy.sum(numpy.cumsum(resids, axis=1) ** 2, axis=1) / nobs ** 2
+        statistic = eta / s_hat
+
+    p_value = numpy.interp(statistic, CRITICAL_VALUES, P_VALUES)
+    p_value[numpy.isnan(statistic)] = numpy.nan
+    return statistic, p_value, lags
+
+
+def stationarity(avails:Sequence) -> numpy.ndarray:
+    """
+    The KPSS p-value of each of the windows, which may be of different
+    lengths. The windows of each length are tested together.
+    """
+    p_values = numpy.full(len(avails), numpy.nan)
+    by_length = {}
+    for i, a in enumerate(avails):
+        by_length.setdefault(len(a), []).append(i)
+    for n, rows in by_length.items():
+        if n < 3: continue
+        p_values[rows] = kpss_ct(numpy.vstack([ avails[_] for _ in rows ]))[1]
+    return p_values
+
+
+def dfkpss_main(myargs:argparse.Namespace) -> int:
+    """
+    Compare kpss_ct() with statsmodels on random windows: random
+    walks, trends, and noise, the shapes of series that we see.
+    """
+    try:
+        from statsmodels.tsa.stattools import kpss
+    except ImportError as e:
+        print("statsmodels is not installed; there is nothing to compare with.")
+        return os.EX_UNAVAILABLE
+
+    rng = numpy.random.default_rng(myargs.seed)
+    n, k = myargs.window_size, myargs.series
+    x = numpy.vstack([
+        numpy.cumsum(rng.normal(size=(k // 3, n)), axis=1),
+        numpy.arange(n) * rng.normal(size=(k // 3, 1)) + rng.normal(size=(k // 3, n)),
+        rng.normal(size=(k - 2 * (k // 3), n)) ]) * 1e6 + 1e10
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        theirs = numpy.array([ kpss(row, regression='ct', nlags='auto')[:3] for row in x ])
+        mine = numpy.column_stack(kpss_ct(x))
+
+        bad = ~numpy.isclose(mine, theirs, rtol=1e-9, atol=0).all(axis=1)
+        print(f"{k} series of {n}: {bad.sum()} differ from statsmodels.")
+        for row in numpy.flatnonzero(bad)[:10]:
+            print(f"    row {row}: {mine[row]} vs {theirs[row]}")
+
+        t_mine = timeit.timeit(lambda: kpss_ct(x), number=myargs.repeat) / myargs.repeat
+        t_theirs = timeit.timeit(lambda: [ kpss(row, regression='ct', nlags='auto') for row in x ],
+            number=myargs.repeat) / myargs.repeat
+    print(f"kpss_ct: {1e3 * t_mine:.2f} ms, statsmodels: {1e3 * t_theirs:.2f} ms, "
+        f"{t_theirs / t_mine:.0f} times faster.")
+
+    return os.EX_DATAERR if bad.any() else os.EX_OK
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog="dfkpss",
+        description="Check kpss_ct against statsmodels, and time them.")
+
+    parser.add_argument('-n', '--window-size', type=int, default=50,
+        help="Length of each series.")
+    parser.add_argument('-k', '--series', type=int, default=300,
+        help="Number of series.")
+    parser.add_argument('--repeat', type=int, default=5,
+        help="Number of times to time each one.")
+    parser.add_argument('--seed', type=int, default=0,
+        help="Seed for the random series.")
+
+    myargs = parser.parse_args()
+
+    try:
+        sys.exit(globals()[f"{os.path.basename(__file__)[:-3]}_main"](myargs))
+
+    except Exception as e:
+        print(f"Escaped or re-raised exception: {e}")
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+import typing
+from   typing import *
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 11)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+import getpass
+import sqlite3
+import time
+
+###
+# Installed libraries like numpy, pandas, paramiko
+###
+
+###
+# From hpclib
+###
+
+###
+# imports and objects that were written for this project.
+###
+from   dfdata import DFStatsDB, ROLLUPS, ROLLUP_BACKFILL, ROLLUP_TABLES, SCHEMA_VERSION
+
+###
+# Global objects
+###
+mynetid = getpass.getuser()
+
+###
+# Credits
+###
+__author__ = mynetid
+__copyright__ = 'Copyright 2024, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = mynetid
+__email__ = f'{mynetid}@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+###
+# dfmigrate converts a database with the original layout, one df_stat
+# table with the host, partition, and a text timestamp in every row,
+# to the layout in dfstat.sql: integer series ids, epoch seconds, and
+# samples clustered on (series_id, ts). df_stat becomes a view of the
+# samples, so the SQL that was written for the old table still works.
+# Stop dfstat before running this.
+#
+# Before version 3, partition_size was the space used on the
+# partition; now it is the size of the partition, and the available
+# space is added to the old values. Version 3 also numbers the good
+# samples in the order they were stored (seq). A database that 
+# already has the version 2 layout gets only these changes 
+# (SIZE_MIGRATION).
+###
+
+MIGRATION = """
+BEGIN EXCLUSIVE;
+DROP VIEW  IF EXISTS v_recent_measurements;
+DROP INDEX IF EXISTS timestamp_idx;
+DROP INDEX IF EXISTS series_idx;
+ALTER TABLE df_stat RENAME TO df_stat_v0;
+
+CREATE TABLE series(
+    series_id INTEGER PRIMARY KEY,
+    host varchar(32),
+    partition varchar(32),
+    UNIQUE (host, partition),
+    FOREIGN KEY (host, partition) REFERENCES hosts(host, partition) ON DELETE CASCADE ON UPDATE CASCADE);
+
+CREATE TABLE samples(
+    series_id int,
+    ts int,
+    partition_size int DEFAULT 0,
+    avail_disk int DEFAULT 0,
+    error_code int DEFAULT 0,
+    seq int,
+    PRIMARY KEY (series_id, ts),
+    FOREIGN KEY (series_id) REFERENCES series(series_id) ON DELETE CASCADE) WITHOUT ROWID;
+
+CREATE INDEX samples_seq ON samples(seq);
+
+CREATE TRIGGER hosts_series AFTER INSERT ON hosts BEGIN
+    INSERT OR IGNORE INTO series (host, partition) VALUES (new.host, new.partition);
+    END;
+
+INSERT INTO series (host, partition) SELECT host, partition FROM hosts ORDER BY host, partition;
+
+INSERT OR REPLACE INTO samples (series_id, ts, partition_size, avail_disk, error_code, seq)
+    SELECT series.series_id, CAST(strftime('%s', df_stat_v0.measured_at) as int),
+        CASE WHEN df_stat_v0.error_code = 0 
+            THEN df_stat_v0.partition_size + df_stat_v0.avail_disk
+            ELSE df_stat_v0.partition_size END, 
+        df_stat_v0.avail_disk, df_stat_v0.error_code,
+        iif(df_stat_v0.error_code = 0, df_stat_v0.rowid, NULL)
+    FROM df_stat_v0 JOIN series
+        ON series.host = df_stat_v0.host AND series.partition = df_stat_v0.partition
+    WHERE df_stat_v0.measured_at IS NOT NULL
+    ORDER BY df_stat_v0.rowid;
+
+CREATE VIEW df_stat as SELECT series.host, series.partition,
+    samples.partition_size, samples.avail_disk, samples.error_code,
+    datetime(samples.ts, 'unixepoch') as measured_at,
+    samples.series_id, samples.ts
+    FROM samples JOIN series USING (series_id);
+
+CREATE TRIGGER df_stat_insert INSTEAD OF INSERT ON df_stat BEGIN
+    INSERT OR REPLACE INTO samples (series_id, ts, partition_size, avail_disk, error_code, seq)
+    SELECT series_id,
+        coalesce(new.ts, CAST(strftime('%s', new.measured_at) as int), CAST(strftime('%s', 'now') as int)),
+        coalesce(new.partition_size, 0),
+        coalesce(new.avail_disk, 0),
+        coalesce(new.error_code, 0),
+        iif(coalesce(new.error_code, 0) = 0, (SELECT coalesce(max(seq), 0) + 1 FROM samples), NULL)
+    FROM series WHERE host = new.host AND partition = coalesce(new.partition, 'ERROR');
+    END;
+
+CREATE VIEW v_recent_measurements as SELECT * FROM df_stat ORDER BY ts DESC;
+"""
+
+###
+# The rollups' sums and last values are converted exactly. The min 
+# and max of the size become bounds, because the available space at
+# the smallest (or largest) size is not kept; they are made exact 
+# again by rolling up the periods whose samples are still there.
+###
+SIZE_MIGRATION = """
+BEGIN EXCLUSIVE;
+UPDATE samples SET partition_size = partition_size + avail_disk WHERE error_code = 0;
+
+ALTER TABLE samples ADD COLUMN seq int;
+UPDATE samples SET seq = numbered.seq FROM 
+    (SELECT series_id, ts, row_number() OVER (ORDER BY ts, series_id) AS seq 
+        FROM samples WHERE error_code = 0) AS numbered
+    WHERE samples.series_id = numbered.series_id AND samples.ts = numbered.ts;
+CREATE INDEX samples_seq ON samples(seq);
+
+DROP TRIGGER IF EXISTS df_stat_insert;
+CREATE TRIGGER df_stat_insert INSTEAD OF INSERT ON df_stat BEGIN
+    INSERT OR REPLACE INTO samples (series_id, ts, partition_size, avail_disk, error_code, seq)
+    SELECT series_id,
+        coalesce(new.ts, CAST(strftime('%s', new.measured_at) as int), CAST(strftime('%s', 'now') as int)),
+        coalesce(new.partition_size, 0),
+        coalesce(new.avail_disk, 0),
+        coalesce(new.error_code, 0),
+        iif(coalesce(new.error_code, 0) = 0, (SELECT coalesce(max(seq), 0) + 1 FROM samples), NULL)
+    FROM series WHERE host = new.host AND partition = coalesce(new.partition, 'ERROR');
+    END;
+"""
+
+ROLLUP_SIZES = """UPDATE {table} SET 
+    min_size = min_size + min_avail, max_size = max_size + max_avail,
+    sum_size = sum_size + sum_avail, last_size = last_size + last_avail
+"""
+
+CURRENT_STATE_SIZES = """UPDATE current_state 
+    SET partition_size = partition_size + avail_disk WHERE partition != 'ERROR'
+"""
+
+
+def has_table(db:sqlite3.Connection, table:str) -> bool:
+    return db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (table,)).fetchone() is not None
+
+
+def migrate_sizes(db:sqlite3.Connection, database:str) -> int:
+    """
+    Convert a version 2 database, in one transaction.
+    """
+    start = time.time()
+    try:
+        db.executescript(SIZE_MIGRATION)
+        for name, (table, period) in ROLLUPS.items():
+            if has_table(db, table):
+                db.execute(ROLLUP_SIZES.format(table=table))
+                db.execute(ROLLUP_BACKFILL.format(table=table, period=period))
+        if has_table(db, 'current_state'):
+            db.execute(CURRENT_STATE_SIZES)
+        db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        db.execute("COMMIT")
+    except Exception as e:
+        db.in_transaction and db.execute("ROLLBACK")
+        print(f"Migration failed, and nothing was changed. {e=}")
+        return os.EX_DATAERR
+
+    print(f"partition_size in {database} is now the size of each partition."
+        f" Converted in {time.time() - start:.1f} seconds.")
+    return os.EX_OK
+
+
+def dfmigrate_main(myargs:argparse.Namespace) -> int:
+
+    if not os.path.exists(myargs.database):
+        print(f"{myargs.database} not found.")
+        return os.EX_NOINPUT
+
+    db = sqlite3.connect(myargs.database, isolation_level=None)
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    if version == 2:
+        result = migrate_sizes(db, myargs.database)
+        db.close()
+        return result
+
+    if version >= SCHEMA_VERSION:
+        print(f"{myargs.database} already has the version {version} layout.")
+        db.close()
+        if myargs.rollups:
+            # Opening it as a writer creates any rollup tables it lacks.
+            db = DFStatsDB(myargs.database)
+            db.rollup_backfill()
+            db.close()
+            print(f"Rebuilt the rollups of {myargs.database} from its samples.")
+        return os.EX_OK
+
+    start = time.time()
+    old_rows = db.execute("SELECT count(*) FROM df_stat").fetchone()[0]
+
+    # The whole conversion is one transaction; if anything goes wrong,
+    # the database is left as it was. The BEGIN is in the script because
+    # executescript() commits any transaction that is already open.
+    try:
+        db.executescript(MIGRATION + "".join(
+            ROLLUP_TABLES.format(name=name, table=table)
+            for name, (table, period) in ROLLUPS.items()))
+    except Exception as e:
+        db.in_transaction and db.execute("ROLLBACK")
+        print(f"Migration failed, and nothing was changed. {e=}")
+        return os.EX_DATAERR
+
+    new_rows = db.execute("SELECT count(*) FROM samples").fetchone()[0]
+    print(f"{old_rows} rows in df_stat became {new_rows} samples.")
+    if new_rows < old_rows and not myargs.force:
+        db.execute("ROLLBACK")
+        print("Some rows have no entry in hosts, or have the same series and time"
+            " as another row. Use --force to migrate anyway.")
+        return os.EX_DATAERR
+
+    # Databases from before the rollups need them to be filled in.
+    for name, (table, period) in ROLLUPS.items():
+        if not db.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+            db.execute(ROLLUP_BACKFILL.format(table=table, period=period))
+
+    db.execute("DROP TABLE df_stat_v0")
+    db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    db.execute("COMMIT")
+    print(f"Converted {myargs.database} in {time.time() - start:.1f} seconds.")
+
+    # Give the space back, and set up the incremental vacuum for retention.
+    if not myargs.no_vacuum:
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("VACUUM")
+        print(f"Vacuumed {myargs.database}.")
+
+    db.close()
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog="dfmigrate",
+        description="Convert a dfstat database to the version 2 layout.")
+
+    parser.add_argument('database', type=str, nargs='?', default="./dfstat.db",
+        help="The database to convert.")
+    parser.add_argument('--force', action='store_true',
+        help="Convert even if some rows cannot be carried over.")
+    parser.add_argument('--no-vacuum', action='store_true',
+        help="Skip the VACUUM at the end.")
+    parser.add_argument('--rollups', action='store_true',
+        help="For a database that is already converted, rebuild the rollups from the samples.")
+
+    myargs = parser.parse_args()
+
+    try:
+        sys.exit(globals()[f"{os.path.basename(__file__)[:-3]}_main"](myargs))
+
+    except Exception as e:
+        print(f"Escaped or re-raised exception: {e}")
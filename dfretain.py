@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Retention removes measurements that are older than we want to keep,
+a few rows at a time, so that it never holds the write lock for long.
+It is run by the MeasurementWriter whenever the writer is idle.
+
+retention = Retention(90, overrides=[{'host':'spydur', 'partition':'/scratch', 'days':365}])
+writer = MeasurementWriter(myconfig.database, logger, maintenance=retention)
+"""
+import typing
+from   typing import *
+
+min_py = (3, 11)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import time
+
+###
+# Installed libraries.
+###
+
+
+###
+# From hpclib
+###
+from   urdecorators import trap
+
+###
+# imports and objects that are a part of this project
+###
+
+
+###
+# Global objects and initializations
+###
+verbose = False
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+def sqlite_time(t:float) -> str:
+    """
+    The same format as SQLite's current_timestamp (UTC).
+    """
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))
+
+
+class Retention:
+    """
+    Every `every` seconds, go through the series one at a time, and
+    delete their old rows batch_size at a time. When all the series
+    have been pruned, give up to vacuum_pages free pages back to the
+    file system.
+    """
+
+    def __init__(self, days:float, *,
+            overrides:Iterable=(),
+            batch_size:int=1000,
+            every:float=3600,
+            vacuum_pages:int=1000) -> None:
+        """
+        days -- how long to keep the measurements.
+        overrides -- a list of {host, partition, days} for the
+            series that are to be kept for some other length of time.
+            A missing partition means all the host's partitions.
+        """
+        self.days = days
+        self.overrides = { (_['host'], _.get('partition')) : _['days'] for _ in overrides }
+        self.batch_size = batch_size
+        self.every = every
+        self.vacuum_pages = vacuum_pages
+
+        self.pending = []
+        self.next_run = time.time()
+
+
+    def keep_days(self, host:str, partition:str) -> float:
+        return self.overrides.get((host, partition),
+            self.overrides.get((host, None), self.days))
+
+
+    def wait_time(self) -> float:
+        """
+        Seconds until there is something to do.
+        """
+        return 0 if self.pending else max(0, self.next_run - time.time())
+
+
+    @trap
+    def step(self, db:object) -> None:
+        """
+        Do one batch of work.
+        """
+        now = time.time()
+        if not self.pending:
+            if now < self.next_run: return
+            self.pending = [ (host, partition) for host, partitions in db.targets.items()
+                for partition in partitions ]
+
+        host, partition = self.pending[-1]
+        cutoff = sqlite_time(now - self.keep_days(host, partition) * 86400)
+        if db.prune(host, partition, cutoff, self.batch_size) < self.batch_size:
+            self.pending.pop()
+
+        if not self.pending:
+            db.incremental_vacuum(self.vacuum_pages)
+            self.next_run = now + self.every
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+PollScheduler decides when each (host, partition) is measured next.
+Rather than polling everything every time_interval seconds, each
+partition has its own interval that shrinks when the partition is
+filling up, or is nearly full, and grows when nothing is happening,
+always within [min_interval, max_interval].
+
+The polls are spread out over the interval rather than made all at
+once. Each host has a phase, a fixed fraction of the interval that
+comes from its name, and its polls are made near that phase, give or
+take some random jitter. 
+
+sched = PollScheduler(db.targets, 300, 3600)
+while True:
+    targets = sched.due()
+    ... measure the targets ...
+    sched.update(host, partition, size, used, avail)
+    time.sleep(sched.wait_time())
+"""
+import typing
+from   typing import *
+
+min_py = (3, 11)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import heapq
+import random
+import time
+import zlib
+
+###
+# Installed libraries.
+###
+
+
+###
+# From hpclib
+###
+from   urdecorators import trap
+
+###
+# imports and objects that are a part of this project
+###
+
+
+###
+# Global objects and initializations
+###
+verbose = False
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+def phase(host:str) -> float:
+    """
+    A fraction in [0, 1) that depends only on the name of the host,
+    so that it is the same every time dfstat starts.
+    """
+    return zlib.crc32(host.encode()) / 2**32
+
+
+class PollScheduler:
+    """
+    A priority queue of the next time each (host, partition) is due.
+    Entries in the heap that have been superseded are skipped when
+    they come to the top, rather than being removed.
+    """
+
+    def __init__(self, targets:dict,
+            min_interval:float,
+            max_interval:float, *,
+            growth:float=1.5,
+            samples_to_full:float=20,
+            high_water:float=0.9,
+            coalesce:float=0.0,
+            jitter:float=0.05) -> None:
+        """
+        targets -- host -> partitions, like DFStatsDB.targets
+        growth -- the factor by which an interval grows when the
+            partition is not filling, and shrinks when it is over
+            the high_water mark.
+        samples_to_full -- when a partition is filling, we want at
+            least this many samples before it is full.
+        high_water -- the fraction of the space used above which the
+            interval only shrinks.
+        coalesce -- when a host is polled, also measure its partitions
+            that are due within this many seconds, to save an ssh.
+        jitter -- polls are moved at random by up to this fraction of 
+            the interval, earlier or later.
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.growth = growth
+        self.samples_to_full = samples_to_full
+        self.high_water = high_water
+        self.coalesce = coalesce
+        self.jitter = jitter
+
+        self.queue = []
+        self.next_due = {}
+        self.interval = {}
+        self.last = {}
+        self.rate = {}
+        self.order = {}
+        self.sync(targets)
+
+
+    def schedule(self, key:tuple, t:float) -> None:
+        self.next_due[key] = t
+        heapq.heappush(self.queue, (t, key))
+
+
+    def stagger(self, host:str, t:float, interval:float) -> float:
+        """
+        Move t to the nearest time that is at the host's phase of the
+        interval, and then add the jitter.
+        """
+        t += (phase(host) * interval - t + interval / 2) % interval - interval / 2
+        return t + random.uniform(-self.jitter, self.jitter) * interval
+
+
+    def sync(self, targets:dict, now:float=None) -> None:
+        """
+        Start scheduling new targets within the next interval, at their
+        host's phase, and forget about the ones that are no longer in 
+        the list. Only partitions that are paths can be measured.
+        """
+        now = time.time() if now is None else now
+        keys = { (host, partition) for host, partitions in targets.items()
+            for partition in partitions if partition.startswith('/') }
+        self.order = { host : i for i, host in enumerate(targets) }
+
+        for key in set(self.interval) - keys:
+            for d in (self.next_due, self.interval, self.last, self.rate):
+                d.pop(key, None)
+
+        for key in sorted(keys - set(self.interval)):
+            self.interval[key] = self.max_interval
+            self.schedule(key, now + phase(key[0]) * self.max_interval)
+
+
+    def due(self, now:float=None) -> dict:
+        """
+        Take everything that is due out of the queue, and return it in
+        the same form as the targets, host -> partitions, in the order
+        of the targets.
+        """
+        now = time.time() if now is None else now
+        due = {}
+        while self.queue and self.queue[0][0] <= now:
+            t, key = heapq.heappop(self.queue)
+            if self.next_due.get(key) != t: continue
+            del self.next_due[key]
+            due.setdefault(key[0], []).append(key[1])
+
+        # Pick up the host's other partitions that are nearly due.
+        if self.coalesce:
+            for key, t in tuple(self.next_due.items()):
+                if key[0] in due and t <= now + self.coalesce:
+                    del self.next_due[key]
+                    due[key[0]].append(key[1])
+
+        return { host : due[host] for host in
+            sorted(due, key=lambda h : self.order.get(h, len(self.order))) }
+
+
+    def update(self, host:str, partition:str,
+            size:int, used:int, avail:int, now:float=None) -> float:
+        """
+        Adjust the interval from the new measurement, and put the
+        partition back in the queue. Returns the new interval.
+        """
+        now = time.time() if now is None else now
+        key = (host, partition)
+        if key not in self.interval: return 0
+
+        interval = self.interval[key]
+        if key in self.last:
+            then, avail_then = self.last[key]
+            if now > then:
+                # Smooth the rate at which space is being used up.
+                rate = (avail_then - avail) / (now - then)
+                self.rate[key] = 0.5 * rate + 0.5 * self.rate.get(key, rate)
+        self.last[key] = (now, avail)
+
+        rate = self.rate.get(key, 0)
+        if rate > 0:
+            interval = min(interval * self.growth, avail / rate / self.samples_to_full)
+        else:
+            interval = interval * self.growth
+
+        if size and used / size >= self.high_water:
+            interval = min(interval, self.interval[key] / self.growth)
+
+        self.interval[key] = max(self.min_interval, min(self.max_interval, interval))
+        self.schedule(key, max(now + self.min_interval / 2, 
+            self.stagger(host, now + self.interval[key], self.interval[key])))
+        return self.interval[key]
+
+
+    def missed(self, host:str, partition:str, now:float=None) -> None:
+        """
+        The partition could not be measured. Try again after the
+        shortest interval, without changing the partition's own.
+        """
+        now = time.time() if now is None else now
+        key = (host, partition)
+        if key in self.interval and key not in self.next_due:
+            self.schedule(key, now + self.min_interval)
+
+
+    def wait_time(self, now:float=None) -> float:
+        """
+        Seconds until the next partition is due.
+        """
+        now = time.time() if now is None else now
+        while self.queue and self.next_due.get(self.queue[0][1]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+        return max(0, self.queue[0][0] - now) if self.queue else self.max_interval
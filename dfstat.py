@@ -30,10 +30,13 @@ if sys.version_info < min_py:
 ###
 import argparse
 from   collections.abc import Generator
+import concurrent.futures
+from   concurrent.futures import ThreadPoolExecutor
 import contextlib
 import getpass
 import logging
 import re
+import shlex
 import signal
 import sqlite3
 import time
@@ -60,8 +63,16 @@ import tomllib
 # imports that are a part of this project
 ###
 import dfanalysis
+from   dfagent import AgentListener
+from   dfchange import Change, ChangeDetector
 from   dfdata import DFStatsDB
+from   dfdeadband import Deadband
+from   dfretain import Retention
+from   dfsched import PollScheduler
+from   dfwriter import MeasurementWriter
+from   localdf import LocalCollector
 from   sshconfig import SSHConfig
+from   sshmux import SSHMux, SSH_CONNECTION_ERROR
 from   urmessage import send_urmessage
 
 ###
@@ -71,11 +82,33 @@ with open("dfstat.toml", 'rb') as f:
     myconfig = SloppyTree(tomllib.load(f)) # None
 
 sshconfig  = None
+mux        = None
 logfile  = f"{os.path.basename(__file__)[:-3]}.log"
 logger     = URLogger(logfile=logfile, level= logging.INFO) #myargs.loglevel) #None
 db         = DFStatsDB(myconfig.database) #None
 my_kids    = set()
 down_hosts = SloppyTree()
+pool       = None
+local      = None
+listener   = None
+writer     = None
+changed    = {}
+mailer     = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dfmail')
+
+###
+# A data row of df -P. The mount point is everything after the 
+# capacity, and the filesystem everything before the numbers; it is
+# empty when the name was too long, and printed on the line before.
+###
+DF_ROW = re.compile(r"(?P<filesystem>.*?)\s+(?P<size>\d+)\s+(?P<used>\d+)\s+(?P<avail>\d+)"
+    r"\s+(?:\d+%|-)\s+(?P<mount>/.*)")
+
+###
+# Error codes for the failures that are noticed by dfstat rather 
+# than reported by ssh or df.
+###
+ERR_EXCEPTION = -1
+ERR_TIMEOUT   = -2
 
 @trap
 def clear_down_hosts(host:str) -> None:
@@ -129,11 +162,40 @@ def manage_down_hosts(host:str) -> None:
             pass
         
 
+def df_rows(lines:Iterable) -> Generator:
+    """
+    Parse the output of df, one line at a time, and yield a tuple of
+    (filesystem, size, used, available, mount point) for each data row.
+    Header rows are skipped wherever they appear, because the output
+    of several df commands may be strung together.
+
+    The row is found by its four numbers and the capacity, so that the
+    filesystem and the mount point may have spaces in them. A 
+    filesystem name that is too long for its column is printed on a
+    line by itself, with the numbers on the following line:
+
+    141.166.186.35:/mnt/usrlocal/8
+                                    3766283008 263690368 3502592640       8% /usr/local/chem.sw
+    """
+    filesystem = None
+    for line in lines:
+        if not line.strip() or line.startswith('Filesystem'):
+            continue
+
+        if (row := DF_ROW.fullmatch(line.rstrip())) is None:
+            filesystem = line.strip()
+            continue
+
+        yield (row['filesystem'] or filesystem, int(row['size']), int(row['used']), 
+            int(row['avail']), row['mount'])
+        filesystem = None
+
+
 @trap
-def extract_df(lines:list, partitions:list) -> object:
+def extract_df(lines:Iterable, partitions:Iterable) -> object:
     """
     This command extracts values from df -P query. The unparsed data 
-    look something like these data rows (but w/o the header).
+    look something like these data rows.
 
     Filesystem                     1024-blocks      Used  Available Capacity Mounted on
     /dev/mapper/rl-root               73334784  16797908   56536876      23% /
@@ -143,23 +205,45 @@ def extract_df(lines:list, partitions:list) -> object:
     """
     global logger
     logger.debug("extract_df")
+    wanted = set(partitions)
     d = {}
-    for line in lines:
-        _0, space, used, available, _1, partition = line.split()
+    for _0, space, used, available, partition in df_rows(lines):
         logger.debug(f"{partition=}")
-        if partition in partitions:
-            d[partition] = [int(space), int(used), int(available)]
+        if partition in wanted:
+            d[partition] = [space, used, available]
             logger.debug(f'{partition=} {space=} {used=} {available=}')
 
     return d
     
 
+@trap
+def df_command(partitions:Iterable) -> str:
+    """
+    Build the command that asks a host about only the partitions we
+    monitor. Each partition gets its own df, so a hung mount can only 
+    cost us its own timeout, and it does not take the others with it.
+    The names that are not paths (e.g., ERROR) are skipped.
+
+    timeout(1) is not on every host, and where it is missing the df
+    runs bare; the per-host timeout on our side of the ssh is then
+    the only limit. The script is run by sh, because the login shell
+    of the remote user might not be a Bourne shell.
+    """
+    t = myconfig.get('poll_timeout', {}).get('mount', 10)
+    dfs = " ; ".join(f"$T df -P {shlex.quote(partition)}"
+        for partition in partitions if partition.startswith('/'))
+    if not dfs:
+        return 'true'
+    return "sh -c " + shlex.quote(
+        f'T= ; command -v timeout >/dev/null 2>&1 && T="timeout -s KILL {t}" ; {dfs}')
+
+
 @trap
 def graceful_exit() -> int:
     """
     Close everything, and leave.
     """
-    global my_kids, db
+    global my_kids, db, pool, mux, listener, writer, mailer
 
     ###
     # The first thing we do, let's kill all the children.
@@ -167,10 +251,24 @@ def graceful_exit() -> int:
     ###
     for pid in my_kids:
         try:
-            os.kill(pid, signal.SIGKILL)
+            os.killpg(pid, signal.SIGKILL)
         except:
             pass
 
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if mux is not None:
+        mux.close_all()
+
+    if listener is not None:
+        listener.stop()
+
+    # Write whatever has been measured, and send the mail about it.
+    if writer is not None:
+        writer.stop()
+    mailer.shutdown(wait=True)
+
     try:
         db.close()
     except:
@@ -206,50 +304,189 @@ def handler(signum:int, stack:object=None) -> None:
         return
 
 @trap
-def query_host(host:str) -> str:
+def query_host(host:str, partitions:Iterable, deadline:float) -> SloppyTree:
     """
-    Returns result of 'df -P' command. This POSIX option
-    assures that different OS-es will return the data in the
+    Returns result of 'df -P' command for the partitions. This POSIX 
+    option assures that different OS-es will return the data in the
     same POSIX format rather than the native format of the
     OS being queried.
+
+    This function runs in the worker threads of the polling pool,
+    so it does not touch the database. The result is handed back
+    to the main thread, and df_lines() sorts out what happened.
+
+    The command is killed if it runs past the per-host timeout, or
+    past the deadline for the round, whichever comes first. A retry
+    after a reconnect gets only what is left of the same budget.
     """
-    global db
-    global down_hosts
     global logger
-    global sshconfig
+    global mux
 
     logger.debug(f"query_host {host=}")
-    hostinfo = SloppyTree(sshconfig[host])
-    logger.debug(f"{hostinfo=}")
-    cmd = f"""
-        ssh {hostinfo.user}@{hostinfo.hostname} 'df -P'
-        """
+    start = time.time()
+    timeout = min(myconfig.get('poll_timeout', {}).get('host', 60), deadline - start)
+    if timeout <= 0:
+        return timed_out()
+    give_up = start + timeout
+
     try: 
-        result = SloppyTree(dorunrun(cmd, return_datatype = dict))
-        
-        if not result.OK:
-            logger.error(f"{result=}")
-            db.record_error(host, result.code)
+        remote_cmd = df_command(partitions)
+        cmd = mux.command(host, remote_cmd)
+        logger.debug(f"{cmd=}")
+        result = SloppyTree(dorunrun(cmd, timeout=timeout, return_datatype = dict))
+
+        # A master that has gone stale gets one more chance, within
+        # the time that is left.
+        if result.code == SSH_CONNECTION_ERROR and give_up - time.time() > 0:
+            logger.info(f"Reconnecting to {host}")
+            mux.reconnect(host)
+            if (left := give_up - time.time()) <= 0:
+                return timed_out()
+            result = SloppyTree(dorunrun(mux.command(host, remote_cmd), 
+                timeout=left, return_datatype = dict))
+        return result
+
+    except Exception as e:
+        logger.error(f"{e=}")
+        if time.time() >= give_up:
+            return timed_out()
+        return SloppyTree({'OK': False, 'code': ERR_EXCEPTION, 'stdout': ''})
+
+
+def timed_out() -> SloppyTree:
+    """
+    The stand-in for the result of a query that did not finish.
+    """
+    return SloppyTree({'OK': False, 'code': ERR_TIMEOUT, 'stdout': ''})
+
+
+@trap
+def df_lines(host:str, result:SloppyTree, errors:list, ts:int) -> list:
+    """
+    Add any error from query_host() to the errors for this round, as
+    of ts, and return the lines of the df output.
+
+    The exit code is that of the last df, so a host can report an error
+    and still have answered for some of its partitions. Those answers 
+    are kept, and the host is not counted as down.
+    """
+    global logger
+
+    if not result.OK:
+        logger.error(f"{result=}")
+        errors.append((host, result.code, ts))
+        if not result.stdout:
             manage_down_hosts(host)
             return []
+
+    clear_down_hosts(host)
+    return result.stdout.splitlines()
+
+
+@trap
+def poll_host(host:str, partitions:Iterable, deadline:float) -> tuple:
+    """
+    Measure the partitions that can be seen from here with statvfs, 
+    and ask the host about the rest. Returns the local measurements,
+    the result of query_host() (or None if no query was needed), and
+    the time of the measurements.
+
+    Like query_host(), this runs in the worker threads of the pool.
+    """
+    global local
+
+    info, remote = local.collect(host, partitions)
+    result = None
+    if any(partition.startswith('/') for partition in remote):
+        result = query_host(host, remote, deadline)
+    return info, result, int(time.time())
+
+
+@trap
+def poll_hosts(targets:dict, deadline:float) -> dict:
+    """
+    Query all the targets at once, using at most max_concurrency
+    ssh sessions, so that a round takes about as long as the slowest
+    host. The results are recorded in the order of the targets, 
+    no matter the order in which the hosts answered.
+
+    The round ends at its deadline. Hosts that have not answered
+    by then are recorded as timed out, and counted as down.
+
+    Everything from the round is handed to the writer at the end, and
+    written in one transaction. Each host's measurements carry the
+    time that the host answered.
+
+    Returns host -> the measurements from extract_df().
+    """
+    global local
+    global logger
+    global pool
+    global writer
+
+    measured = {}
+    measurements = []
+    errors = []
+    futures = { host : pool.submit(poll_host, host, partitions, deadline) 
+        for host, partitions in targets.items() }
+    done, not_done = concurrent.futures.wait(futures.values(), 
+        timeout=max(0, deadline - time.time()))
+    for f in not_done:
+        f.cancel()
+
+    for host, partitions in targets.items():
+        if futures[host] in done:
+            info, result, ts = futures[host].result()
         else:
-            clear_down_hosts(host)
+            logger.error(f"{host} missed the deadline for this round.")
+            info, result, ts = {}, timed_out(), int(time.time())
 
-        # return the lines, minus the header row, and with the \n chopped off.
-        result = [ _.strip() for _ in result.stdout.split('\n')[1:] ]
-        logger.debug("{result=}")
-        return result
+        if result is not None:
+            lines = df_lines(host, result, errors, ts)
+            local.learn(host, df_rows(lines))
+            info.update(extract_df(lines, partitions))
 
+        for partition in partitions:
+            if partition in info:
+                size, used, avail = info[partition]
+                measurements.append((host, partition, size, avail, ts))
+        measured[host] = info
+
+    writer.put(measurements, errors)
+    return measured
+
+    
+def report_change(change:Change) -> None:
+    """
+    Called by the writer's thread when the space on a partition has
+    dropped suddenly. Every drop is logged; mail is sent at most once
+    per repeat seconds for each partition, by the mailer's thread, so
+    that the writer does not wait for it.
+    """
+    lost = change.avail_then - change.avail_now
+    minutes = (change.ts - change.since) / 60
+    text = (f"{change.host}:{change.partition} lost {lost} blocks "
+        f"({100 * lost / max(1, change.size):.1f}% of it) in {minutes:.0f} minutes; "
+        f"{change.avail_now} blocks are left.")
+    logger.warning(text)
+
+    key = change.host, change.partition
+    now = time.time()
+    if now - changed.get(key, 0) < myconfig.get('change', {}).get('repeat', myconfig.message_repeat):
+        return
+    changed[key] = now
+    mailer.submit(send_change, f"{change.host}:{change.partition} is filling suddenly")
+
+
+def send_change(subject:str) -> None:
+    """
+    Runs in the mailer's thread, where nothing is waiting on it.
+    """
+    try:
+        dfanalysis.send_email(subject)
     except Exception as e:
-        db.record_error(host, -1)
-        logger.error(f"{e=}")
-        return []
-        # another try-except to avoid foreign key constraint error,
-        # that is related to a wrong host name
-        try:
-            db.record_error(host, -1)
-        except:
-            return []
+        logger.error(f"Cannot send mail about a change: {subject}. {e=}")
+
     
 @trap
 def null_generator():
@@ -283,6 +520,11 @@ def dfstat_main(myconfig:SloppyTree, analyze_this:bool) -> int:
     global sshconfig
     global db
     global logger
+    global pool
+    global mux
+    global local
+    global listener
+    global writer
     logger.debug("main")
 
     # Read the ssh info. SSHConfig is derived from SloppyTree
@@ -294,23 +536,130 @@ def dfstat_main(myconfig:SloppyTree, analyze_this:bool) -> int:
     else:
         logger.debug(f"{sshconfig=}")
 
+    ###
+    # One shared ssh connection per host, kept open between polls.
+    ###
+    mux_config = myconfig.get('ssh_mux', {})
+    mux = SSHMux(sshconfig, 
+        mux_config.get('control_dir', '~/.ssh/dfstat'),
+        mux_config.get('persist', 2 * myconfig.time_interval))
+
     ###
     # Kick off the analyzer
     ###
     if analyze_this:
         if (pid := os.fork()):
-            dfanalysis.dfanalysis_main()
-        else:
             my_kids.add(pid)
+            try:
+                os.setpgid(pid, pid)
+            except OSError as e:
+                pass
+        else:
+            # The child opens its own connection to the database. It 
+            # leads its own process group, so that its analysis workers
+            # are killed along with it.
+            os.setpgid(0, 0)
+            os._exit(dfanalysis.dfanalysis_main())
+
+    ###
+    # The partitions that we can see from here are measured directly.
+    ###
+    local_config = myconfig.get('local', {})
+    local = LocalCollector(local_config.get('hostnames', ()),
+        local_config.get('shared_filesystems'),
+        myconfig.get('poll_timeout', {}).get('mount', 10))
+
+    ###
+    # All the measurements are written to the database by the writer
+    # thread, so that collecting them does not wait on the disk.
+    ###
+    # Old measurements are removed by the writer when it is not busy.
+    retention_config = myconfig.get('retention', {})
+    retention = Retention(retention_config.get('days', 365),
+        overrides = retention_config.get('keep', ()),
+        batch_size = retention_config.get('batch_size', 1000),
+        every = retention_config.get('every', 3600),
+        vacuum_pages = retention_config.get('vacuum_pages', 1000)
+        ) if retention_config.get('days') else None
+
+    # Measurements that have hardly changed are not stored.
+    deadband_config = myconfig.get('deadband', {})
+    deadband = Deadband(
+        absolute = deadband_config.get('absolute', 0),
+        relative = deadband_config.get('relative', 0.0),
+        heartbeat = deadband_config.get('heartbeat')
+        ) if deadband_config.get('heartbeat') else None
+
+    # Sudden drops are noticed as the measurements arrive.
+    change_config = myconfig.get('change', {})
+    detector = ChangeDetector(
+        delta = change_config.get('delta', 0.001),
+        threshold = change_config.get('threshold'),
+        alpha = change_config.get('alpha', 0.05),
+        alert = report_change
+        ) if change_config.get('threshold') else None
+    if detector is not None:
+        detector.seed(db.usual_rates(time.time() - 3600 * change_config.get('seed_hours', 24)))
+
+    writer_config = myconfig.get('writer', {})
+    writer = MeasurementWriter(myconfig.database, logger,
+        queue_size = writer_config.get('queue_size', 1000),
+        batch_size = writer_config.get('batch_size', 500),
+        max_delay = writer_config.get('max_delay', 5),
+        maintenance = retention,
+        deadband = deadband,
+        detector = detector)
+    writer.start()
+
+    ###
+    # The hosts running dfagent push their own measurements, so
+    # we listen for them instead of polling them.
+    ###
+    agent_config = myconfig.get('agent', {})
+    push_hosts = set(agent_config.get('hosts', ()))
+    if agent_config.get('port'):
+        listener = AgentListener(writer, 
+            (agent_config.get('listen', '127.0.0.1'), agent_config['port']),
+            db.targets, logger, push_hosts, agent_config.get('allow', ()))
+        listener.start()
+
+    ###
+    # The ssh sessions are run in parallel, at most max_concurrency
+    # of them at a time.
+    ###
+    pool = ThreadPoolExecutor(max_workers=myconfig.get('max_concurrency', 8),
+        thread_name_prefix='dfstat')
+
+    ###
+    # Each partition is measured on its own schedule. A round lasts
+    # at most a fraction of the shortest interval.
+    ###
+    schedule_config = myconfig.get('schedule', {})
+    sched = PollScheduler({},
+        schedule_config.get('min_interval', myconfig.time_interval),
+        schedule_config.get('max_interval', myconfig.time_interval),
+        growth = schedule_config.get('growth', 1.5),
+        samples_to_full = schedule_config.get('samples_to_full', 20),
+        high_water = schedule_config.get('high_water', 0.9),
+        coalesce = schedule_config.get('coalesce', 0),
+        jitter = schedule_config.get('jitter', 0.05))
+    round_time = sched.min_interval * myconfig.get('poll_timeout', {}).get('round', 0.5)
 
     try:
         while True:
-            for host, partitions in db.targets.items():
-                info = extract_df(query_host(host), partitions)
-                for partition, values in info.items():
-                    db.record_measurement(host, partition, values[1], values[2])
-
-            time.sleep(myconfig.time_interval)
+            sched.sync({ host : partitions for host, partitions in db.targets.items()
+                if host not in push_hosts })
+            targets = sched.due()
+            measured = poll_hosts(targets, time.time() + round_time)
+            for host, partitions in targets.items():
+                for partition in partitions:
+                    if partition in measured.get(host, {}):
+                        sched.update(host, partition, *measured[host][partition])
+                    else:
+                        sched.missed(host, partition)
+
+            mux.expire_idle()
+            time.sleep(sched.wait_time())
     finally:
         return graceful_exit()
         
@@ -331,7 +680,7 @@ def dfstat_main(myconfig:SloppyTree, analyze_this:bool) -> int:
             info = extract_df(query_host(host), partitions)
             
             for partition, values in info.items():
-                db.record_measurement(host, partition, values[1], values[2])
+                db.record_measurement(host, partition, values[0], values[2])
     except Exception as e:
         print(f"Something went wrong: {e}.")
 
@@ -1,29 +1,160 @@
+PRAGMA auto_vacuum = INCREMENTAL;
+
 DROP VIEW  IF EXISTS v_recent_measurements;
 DROP VIEW  IF EXISTS v_hosts;
-DROP INDEX IF EXISTS timestamp_index;
-DROP TABLE IF EXISTS df_stat;
+DROP VIEW  IF EXISTS v_hourly;
+DROP VIEW  IF EXISTS v_daily;
+DROP VIEW  IF EXISTS df_stat;
+DROP VIEW  IF EXISTS v_current;
+DROP VIEW  IF EXISTS v_forecasts;
+DROP TABLE IF EXISTS current_state;
+DROP TABLE IF EXISTS forecasts;
+DROP TABLE IF EXISTS df_stat_hourly;
+DROP TABLE IF EXISTS df_stat_daily;
+DROP TABLE IF EXISTS samples;
+DROP TABLE IF EXISTS series;
 DROP TABLE IF EXISTS hosts;
 
+-- Version 3 of the layout. Each (host, partition) is a series with an
+-- integer id, and the measurements are stored by series and time (in
+-- epoch seconds), clustered on (series_id, ts). partition_size is the
+-- size of the partition, not the space used on it, and the good 
+-- samples are numbered in the order they are stored.
+PRAGMA user_version = 3;
+
 CREATE TABLE hosts( 
     host varchar(32), 
     partition varchar(32), 
     PRIMARY KEY (host, partition) 
     );
 
-CREATE TABLE df_stat( 
+CREATE TABLE series( 
+    series_id INTEGER PRIMARY KEY, 
     host varchar(32), 
-    partition varchar(32) DEFAULT 'ERROR', 
+    partition varchar(32), 
+    UNIQUE (host, partition), 
+    FOREIGN KEY (host, partition) REFERENCES hosts(host, partition) ON DELETE CASCADE ON UPDATE CASCADE);
+
+-- seq numbers the good samples in the order they are stored, so that
+-- a copy of them (see dfarchive.py) can pick up the ones that arrive 
+-- late, after a later ts has already been stored.
+CREATE TABLE samples( 
+    series_id int, 
+    ts int, 
     partition_size int DEFAULT 0, 
     avail_disk int DEFAULT 0, 
     error_code int DEFAULT 0, 
-    measured_at datetime default current_timestamp, 
-    FOREIGN KEY (host, partition) REFERENCES hosts(host, partition) ON DELETE CASCADE ON UPDATE CASCADE);
+    seq int,
+    PRIMARY KEY (series_id, ts), 
+    FOREIGN KEY (series_id) REFERENCES series(series_id) ON DELETE CASCADE) WITHOUT ROWID;
+
+CREATE INDEX samples_seq ON samples(seq);
+
+CREATE TRIGGER hosts_series AFTER INSERT ON hosts BEGIN
+    INSERT OR IGNORE INTO series (host, partition) VALUES (new.host, new.partition);
+    END;
+
+-- df_stat is the original table, as a view of the samples. Inserts 
+-- into it are turned into inserts into samples, so the SQL written for
+-- the original layout keeps working.
+CREATE VIEW df_stat as SELECT series.host, series.partition, 
+    samples.partition_size, samples.avail_disk, samples.error_code, 
+    datetime(samples.ts, 'unixepoch') as measured_at, 
+    samples.series_id, samples.ts
+    FROM samples JOIN series USING (series_id);
+
+CREATE TRIGGER df_stat_insert INSTEAD OF INSERT ON df_stat BEGIN
+    INSERT OR REPLACE INTO samples (series_id, ts, partition_size, avail_disk, error_code, seq) 
+    SELECT series_id, 
+        coalesce(new.ts, CAST(strftime('%s', new.measured_at) as int), CAST(strftime('%s', 'now') as int)),
+        coalesce(new.partition_size, 0), 
+        coalesce(new.avail_disk, 0), 
+        coalesce(new.error_code, 0),
+        iif(coalesce(new.error_code, 0) = 0, (SELECT coalesce(max(seq), 0) + 1 FROM samples), NULL)
+    FROM series WHERE host = new.host AND partition = coalesce(new.partition, 'ERROR');
+    END;
+
+CREATE TABLE df_stat_hourly( 
+    host varchar(32), 
+    partition varchar(32), 
+    period datetime, 
+    n int, 
+    min_avail int, 
+    max_avail int, 
+    sum_avail int, 
+    last_avail int, 
+    min_size int, 
+    max_size int, 
+    sum_size int, 
+    last_size int, 
+    last_at datetime, 
+    PRIMARY KEY (host, partition, period));
 
-CREATE INDEX timestamp_idx on df_stat(measured_at);
+CREATE TABLE df_stat_daily( 
+    host varchar(32), 
+    partition varchar(32), 
+    period datetime, 
+    n int, 
+    min_avail int, 
+    max_avail int, 
+    sum_avail int, 
+    last_avail int, 
+    min_size int, 
+    max_size int, 
+    sum_size int, 
+    last_size int, 
+    last_at datetime, 
+    PRIMARY KEY (host, partition, period));
+
+-- The last good measurement of each series, and the last error of 
+-- each host (in its ERROR row), kept up to date by DFStatsDB.
+CREATE TABLE current_state( 
+    host varchar(32), 
+    partition varchar(32), 
+    ts int, 
+    partition_size int, 
+    avail_disk int, 
+    error_code int DEFAULT 0, 
+    error_ts int, 
+    PRIMARY KEY (host, partition)) WITHOUT ROWID;
+
+CREATE VIEW v_current as SELECT host, partition, 
+    partition_size, avail_disk, datetime(ts, 'unixepoch') as measured_at, 
+    error_code, datetime(error_ts, 'unixepoch') as error_at, 
+    CAST(strftime('%s', 'now') as int) - ts as since_success 
+    FROM current_state;
+
+-- How fast each series is filling, and the hours it has left, as of
+-- the analyzer's last cycle. Partitions that are not filling have a
+-- NULL hours_to_full.
+CREATE TABLE forecasts( 
+    host varchar(32), 
+    partition varchar(32), 
+    ts int, 
+    avail_disk int, 
+    slope real, 
+    hours_to_full real, 
+    PRIMARY KEY (host, partition)) WITHOUT ROWID;
+
+CREATE VIEW v_forecasts as SELECT host, partition, 
+    datetime(ts, 'unixepoch') as forecast_at, avail_disk, 
+    slope as blocks_per_hour, hours_to_full, 
+    datetime(ts + 3600 * hours_to_full, 'unixepoch') as full_at 
+    FROM forecasts WHERE hours_to_full IS NOT NULL ORDER BY hours_to_full;
 
 CREATE VIEW v_hosts as SELECT * FROM hosts ORDER BY host, partition;
 
-CREATE VIEW v_recent_measurements as SELECT * FROM df_stat ORDER BY measured_at DESC;
+CREATE VIEW v_recent_measurements as SELECT * FROM df_stat ORDER BY ts DESC;
+
+CREATE VIEW v_hourly as SELECT host, partition, period, n, 
+    min_avail, max_avail, 1.0 * sum_avail / n as mean_avail, last_avail,
+    min_size, max_size, 1.0 * sum_size / n as mean_size, last_size
+    FROM df_stat_hourly;
+
+CREATE VIEW v_daily as SELECT host, partition, period, n, 
+    min_avail, max_avail, 1.0 * sum_avail / n as mean_avail, last_avail,
+    min_size, max_size, 1.0 * sum_size / n as mean_size, last_size
+    FROM df_stat_daily;
 
 insert into hosts (host, partition) values ('alexis', 'ERROR');
 insert into hosts (host, partition) values ('alexis', '/home');
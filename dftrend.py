@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Fleet-wide trend statistics, computed for all the analysis windows at
+once. The windows are stacked into one matrix, a row per series,
+aligned on the right (the newest sample is in the last column) and
+padded with nan on the left, and each statistic is one pass of array
+arithmetic over the whole matrix.
+
+t, a = stack([ w.columns() for w in windows ], window_size)
+keep = prescreen(t, a, trend_t=2.0)
+hours, slope, avail_now = time_to_full(t, a, last_avail)
+"""
+import typing
+from   typing import *
+
+min_py = (3, 11)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import warnings
+
+###
+# Installed libraries.
+###
+import numpy
+
+###
+# From hpclib
+###
+
+###
+# imports and objects that are a part of this project
+###
+
+###
+# Global objects and initializations
+###
+verbose = False
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+def stack(windows:Sequence, width:int) -> tuple:
+    """
+    windows -- Columns (or anything with ts and avail_disk), oldest
+        first.
+    Returns (t, a), two float matrices of shape (len(windows), width):
+    the hours before each series' last sample, and the available
+    space less the last value. The offsets keep the arithmetic exact
+    in float64.
+    """
+    t = numpy.full((len(windows), width), numpy.nan)
+    a = numpy.full((len(windows), width), numpy.nan)
+    for i, w in enumerate(windows):
+        n = min(width, len(w.ts))
+        if not n: continue
+        ts, avail = w.ts[-n:], w.avail_disk[-n:]
+        t[i, width - n:] = (ts - ts[-1]) / 3600
+        a[i, width - n:] = avail - avail[-1]
+    return t, a
+
+
+def ols(t:numpy.ndarray, a:numpy.ndarray) -> tuple:
+    """
+    The least squares line through each row of (t, a), ignoring the
+    nans. Returns the arrays (n, slope, intercept, residual variance,
+    sum of squares of t about its mean). Rows with fewer than three
+    points have a residual variance of nan.
+    """
+    with numpy.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        # The rows of series with no samples are all nan.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        n = numpy.sum(~numpy.isnan(a), axis=1)
+        t_mean = numpy.nanmean(t, axis=1)
+        a_mean = numpy.nanmean(a, axis=1)
+        dt = t - t_mean[:, None]
+        stt = numpy.nansum(dt * dt, axis=1)
+        slope = numpy.where(stt > 0, numpy.nansum(dt * (a - a_mean[:, None]), axis=1) / stt, 0.0)
+        intercept = a_mean - slope * t_mean
+        residuals = a - (intercept[:, None] + slope[:, None] * t)
+        variance = numpy.where(n > 2, numpy.nansum(residuals * residuals, axis=1) / (n - 2), numpy.nan)
+    return n, slope, intercept, variance, stt
+
+
+def prescreen(t:numpy.ndarray, a:numpy.ndarray, trend_t:float=0.0) -> numpy.ndarray:
+    """
+    Which series are worth a stationarity test. An alert needs the
+    last sample to be lower than the one before it (is_mem_drop), so
+    the others are never tested. With a trend_t, the series must
+    also be filling: its slope must be negative, and at least trend_t
+    standard errors from zero.
+    """
+    n, slope, intercept, variance, stt = ols(t, a)
+    with numpy.errstate(invalid='ignore'):
+        keep = (a[:, -1] < a[:, -2]) & (n > 2)
+        if trend_t:
+            with numpy.errstate(divide='ignore'):
+                t_stat = slope / numpy.sqrt(variance / stt)
+            keep &= (slope < 0) & (t_stat <= -trend_t)
+    return keep
+
+
+def theil_sen(t:numpy.ndarray, a:numpy.ndarray, rows:int=1000) -> tuple:
+    """
+    The Theil-Sen line through each row of (t, a): the slope is the
+    median of the slopes between all pairs of points, and the
+    intercept is the median of a - slope * t. Unlike least squares,
+    a few odd samples (a big file that came and went) hardly move it.
+    The pairs are taken rows at a time, to bound the memory.
+    Returns the arrays (slope, intercept).
+    """
+    i, j = numpy.triu_indices(t.shape[1], 1)
+    slope = numpy.full(t.shape[0], numpy.nan)
+    with numpy.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        # All-nan rows are expected, and stay nan.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for start in range(0, t.shape[0], rows):
+            tt, aa = t[start:start + rows], a[start:start + rows]
+            dt = tt[:, j] - tt[:, i]
+            slopes = numpy.where(dt > 0, (aa[:, j] - aa[:, i]) / dt, numpy.nan)
+            slope[start:start + rows] = numpy.nanmedian(slopes, axis=1)
+        intercept = numpy.nanmedian(a - slope[:, None] * t, axis=1)
+    return slope, intercept
+
+
+def time_to_full(t:numpy.ndarray, a:numpy.ndarray, last_avail:numpy.ndarray,
+        min_points:int=3) -> tuple:
+    """
+    Hours until each partition is full, from the Theil-Sen line through
+    its window (as from stack()), and the last available space. The 
+    hours are inf for a partition that is not filling, or that has 
+    fewer than min_points samples.
+    Returns the arrays (hours, slope in blocks per hour, space now).
+    """
+    slope, intercept = theil_sen(t, a)
+    avail_now = numpy.maximum(0, last_avail + numpy.nan_to_num(intercept))
+    enough = numpy.sum(~numpy.isnan(a), axis=1) >= min_points
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        hours = numpy.where(enough & (slope < 0), avail_now / -slope, numpy.inf)
+    return hours, slope, avail_now
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+The analyzer keeps the last window_size samples of each series in a
+ring buffer, so that each cycle only reads what has been recorded
+since the last one. The buffers are filled from the database (or the
+archive) when the analyzer starts, when a series first appears, and
+when a sample arrives late.
+
+windows = WindowCache(myconfig.window_size)
+while True:
+    windows.refresh(db, db.targets)
+    for (host, partition), w in windows.items():
+        analyze(w.columns().avail_disk)
+"""
+import typing
+from   typing import *
+
+min_py = (3, 11)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+
+###
+# Installed libraries.
+###
+import numpy
+
+###
+# From hpclib
+###
+
+###
+# imports and objects that are a part of this project
+###
+from   dfdata import Columns, DFStatsDB, series_columns
+
+###
+# Global objects and initializations
+###
+verbose = False
+
+###
+# The new samples are read this many at a time.
+###
+BATCH_SIZE = 100000
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+class SeriesWindow:
+    """
+    The last `capacity` (ts, size, avail) of one series, in three
+    int64 arrays used as a ring. The statistics of the windows are
+    not kept here; they are computed for all the windows at once
+    (see dftrend), which costs less than keeping them one by one.
+    """
+
+    def __init__(self, capacity:int) -> None:
+        self.capacity = capacity
+        self.data = numpy.zeros((3, capacity), dtype=numpy.int64)
+        self.head = 0
+        self.n = 0
+        self.seen = -1
+        self.raw = numpy.zeros((3, 0), dtype=numpy.int64)
+
+
+    def __len__(self) -> int:
+        return self.n
+
+
+    def append(self, ts:int, size:int, avail:int) -> None:
+        self.n = min(self.n + 1, self.capacity)
+        self.data[:, self.head] = (ts, size, avail)
+        self.head = (self.head + 1) % self.capacity
+
+
+    def extend(self, rows:Iterable) -> None:
+        for ts, size, avail in rows:
+            self.append(ts, size, avail)
+
+
+    def fill(self, columns:Columns) -> None:
+        """
+        Replace the window with the columns, oldest first.
+        """
+        self.n = min(len(columns.ts), self.capacity)
+        self.data[:, :self.n] = numpy.array(columns)[:, len(columns.ts) - self.n:]
+        self.head = self.n % self.capacity
+
+
+    def columns(self) -> Columns:
+        """
+        The window, oldest first.
+        """
+        if self.n < self.capacity:
+            return Columns(*self.data[:, :self.n])
+        return Columns(*numpy.roll(self.data, -self.head, axis=1))
+
+
+class WindowCache:
+    """
+    A SeriesWindow for each (host, partition) that is being analyzed.
+    With a step, the windows hold the series as if it had been
+    measured every step seconds, on a grid that ends at its last
+    sample, exactly as DFStatsDB.step_arrays() would return it. The
+    grid moves with every new sample, so the window is stepped again
+    each time from the stored samples that it spans, which are kept
+    in the window's raw.
+
+    The new samples of all the series are read together, in the order
+    they were stored, after the seq of the last one read. A window
+    that gets a sample from before its last one is warmed again.
+    """
+
+    def __init__(self, window_size:int, step:int=0) -> None:
+        self.window_size = window_size
+        self.step = step
+        self.windows = {}
+        self.seq = None
+
+
+    def __getitem__(self, key:tuple) -> SeriesWindow:
+        return self.windows[key]
+
+
+    def items(self) -> Iterable:
+        return self.windows.items()
+
+
+    def warm(self, db:DFStatsDB, host:str, partition:str, archive:object=None) -> SeriesWindow:
+        """
+        Fill a new window from the archive, if there is one, or else
+        from the database.
+        """
+        w = SeriesWindow(self.window_size)
+        if self.step:
+            if (until := db.last_good(host, partition)) is None:
+                return w
+            if archive is not None:
+                columns = archive.read(host, partition)
+                rows = numpy.array([columns['ts'], columns['partition_size'], columns['avail_disk']])
+                rows = rows[:, rows[0] <= until]
+            else:
+                rows = numpy.array(db.step_rows(host, partition, self.window_size, self.step, until))
+            self.restep(w, rows)
+            return w
+
+        if archive is not None:
+            columns = archive.columns(host, partition, self.window_size)
+        else:
+            columns = db.recent_arrays(host, partition, self.window_size)
+        w.extend(zip(*columns))
+        if len(w):
+            w.seen = int(columns.ts[-1])
+        return w
+
+
+    def advance(self, w:SeriesWindow, rows:list) -> None:
+        """
+        Add rows of (ts, size, avail), which all come after the window's
+        last sample, oldest first.
+        """
+        if not self.step:
+            w.seen = rows[-1][0]
+            w.extend(rows)
+            return
+
+        self.restep(w, numpy.array(rows, dtype=numpy.int64).T)
+
+
+    def restep(self, w:SeriesWindow, rows:numpy.ndarray) -> None:
+        """
+        Add rows, the stored samples as (ts, size, avail) arrays, to the
+        window's raw, and step the window again on the grid that ends
+        at the last of them. Only the raw samples from the last one at
+        or before the start of the grid are kept.
+        """
+        raw = numpy.concatenate([w.raw, numpy.asarray(rows, dtype=numpy.int64)], axis=1)
+        if not raw.shape[1]: return
+
+        until = int(raw[0, -1])
+        start = until - (self.window_size - 1) * self.step
+        w.raw = raw[:, max(0, numpy.searchsorted(raw[0], start, side='right') - 1):]
+        w.seen = until
+        w.fill(series_columns(*w.raw, self.window_size, self.step, until))
+
+
+    def refresh(self, db:DFStatsDB, targets:dict, archive:object=None) -> None:
+        """
+        Bring every window up to date, start windows for the new
+        series, and drop the ones that are no longer targets.
+        """
+        keys = { (host, partition) for host, partitions in targets.items()
+            for partition in partitions if partition.startswith('/') }
+        for key in set(self.windows) - keys:
+            del self.windows[key]
+
+        # Before the first windows are warmed, start from now.
+        if self.seq is None:
+            self.seq = db.last_seq()
+        stored = {}
+        while (batch := db.stored_since(self.seq, BATCH_SIZE)):
+            for _, host, partition, ts, size, avail in batch:
+                stored.setdefault((host, partition), []).append((ts, size, avail))
+            self.seq = batch[-1][0]
+
+        for host, partition in sorted(keys):
+            w = self.windows.get((host, partition))
+            rows = sorted(stored.get((host, partition), ()))
+            if w is None or rows and rows[0][0] <= w.seen:
+                self.windows[host, partition] = self.warm(db, host, partition, archive)
+            elif rows:
+                self.advance(w, rows)
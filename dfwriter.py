@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+MeasurementWriter is the only thread that writes measurements to the
+database. The collectors (the polling loop and the agent listener)
+put what they have measured in its queue, and go back to collecting,
+so they do not wait on the disk or on a lock held by the analyzer.
+
+writer = MeasurementWriter(myconfig.database, logger)
+writer.start()
+writer.put(measurements, errors)
+...
+writer.stop()
+"""
+import typing
+from   typing import *
+
+min_py = (3, 11)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import queue
+import threading
+import time
+
+###
+# Installed libraries.
+###
+
+
+###
+# From hpclib
+###
+from   urdecorators import trap
+
+###
+# imports and objects that are a part of this project
+###
+from   dfdata import DFStatsDB
+
+###
+# Global objects and initializations
+###
+verbose = False
+
+###
+# Seconds to wait before trying the maintenance again after it fails.
+###
+MAINTENANCE_RETRY = 60
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+class MeasurementWriter(threading.Thread):
+    """
+    A bounded queue of (measurements, errors) pairs, and the thread
+    that empties it. Each pair is committed whole, in the same
+    transaction, and pairs are combined into larger transactions
+    when they arrive faster than max_delay.
+    """
+
+    def __init__(self, database:str, logger:object, *,
+            queue_size:int=1000,
+            batch_size:int=500,
+            max_delay:float=5.0,
+            maintenance:object=None,
+            deadband:object=None,
+            detector:object=None) -> None:
+        """
+        queue_size -- the number of pairs that may be waiting. When
+            the queue is full, put() waits for room.
+        batch_size -- commit when this many rows are waiting ...
+        max_delay -- ... or when the oldest one has waited this many
+            seconds.
+        maintenance -- an object with wait_time() and step(db), that
+            is given a turn whenever nothing is waiting to be written.
+        deadband -- an object with select() and stored() that picks
+            the measurements that get a row in samples. Without one,
+            they all do.
+        detector -- an object with update() that is shown the
+            measurements as they come off the queue, before they wait
+            to be written.
+        """
+        super().__init__(name='dfwriter', daemon=True)
+        self.database = database
+        self.logger = logger
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.maintenance = maintenance
+        self.deadband = deadband
+        self.detector = detector
+        self.resume = 0
+
+
+    def put(self, measurements:Iterable, errors:Iterable=()) -> None:
+        """
+        Queue the rows to be written. If the writer has fallen behind
+        and the queue is full, the caller waits until there is room.
+        If the writer's thread is not running, nothing would ever make
+        room, so this raises a RuntimeError instead.
+        """
+        item = (list(measurements), list(errors))
+        if not (item[0] or item[1]): return
+
+        while True:
+            if not self.is_alive():
+                raise RuntimeError(f"The writer has stopped; {len(item[0])} measurements"
+                    f" and {len(item[1])} errors cannot be written.")
+            try:
+                self.queue.put(item, timeout=self.max_delay)
+                return
+            except queue.Full as e:
+                self.logger.error(f"Writer queue is full; waiting for the database.")
+
+
+    def stop(self, timeout:float=None) -> None:
+        """
+        Write everything that is in the queue, and end the thread.
+        """
+        if not self.is_alive(): return
+        self.queue.put(None)
+        self.join(timeout)
+
+
+    def flush(self, db:DFStatsDB, measurements:list, errors:list) -> None:
+        samples = measurements if self.deadband is None else self.deadband.select(measurements)
+        unmatched = []
+        try:
+            db.record_round(measurements, errors, samples, unmatched)
+            self.deadband is not None and self.deadband.stored(samples)
+        except Exception as e:
+            self.logger.error(f"Lost {len(measurements)} measurements and {len(errors)} errors. {e=}")
+
+        for row in unmatched:
+            self.logger.error(f"{row} has no series in the database, and was not stored.")
+
+
+    def watch(self, measurements:list) -> None:
+        if self.detector is None: return
+        try:
+            self.detector.update(measurements)
+        except Exception as e:
+            self.logger.error(f"Change detection failed. {e=}")
+
+
+    def timeout(self, oldest:float) -> float:
+        """
+        How long to wait for the next item before there is something
+        else to do.
+        """
+        t = None if oldest is None else max(0, oldest + self.max_delay - time.time())
+        if self.maintenance is not None:
+            m = max(self.maintenance.wait_time(), self.resume - time.time())
+            t = m if t is None else min(t, m)
+        return t
+
+
+    def maintain(self, db:DFStatsDB) -> None:
+        """
+        Give the maintenance a turn. If it fails, it is left alone for
+        MAINTENANCE_RETRY seconds, and the writing goes on.
+        """
+        if time.time() < self.resume: return
+        try:
+            self.maintenance.step(db)
+        except Exception as e:
+            self.resume = time.time() + MAINTENANCE_RETRY
+            self.logger.error(f"Maintenance failed; trying again in {MAINTENANCE_RETRY} seconds. {e=}")
+
+
+    def run(self) -> None:
+        """
+        The database connection is opened here, so that it belongs to
+        this thread. Failures to write are logged, and the thread goes
+        on; if the thread does end, put() raises rather than waiting.
+        """
+        try:
+            db = DFStatsDB(self.database)
+        except Exception as e:
+            self.logger.error(f"The writer cannot open {self.database}, and has stopped. {e=}")
+            return
+
+        measurements, errors = [], []
+        oldest = None
+        done = False
+        try:
+            while not done:
+                try:
+                    item = self.queue.get(timeout=self.timeout(oldest))
+                except queue.Empty as e:
+                    item = ()
+
+                if item is None:
+                    done = True
+                elif item:
+                    self.watch(item[0])
+                    measurements.extend(item[0])
+                    errors.extend(item[1])
+                    oldest = oldest or time.time()
+
+                if oldest is not None and (done or
+                        len(measurements) + len(errors) >= self.batch_size or
+                        time.time() - oldest >= self.max_delay):
+                    self.flush(db, measurements, errors)
+                    measurements, errors = [], []
+                    oldest = None
+
+                # Nothing came, and nothing is waiting to be written.
+                if item == () and oldest is None and self.maintenance is not None:
+                    self.maintain(db)
+
+        except Exception as e:
+            self.logger.error(f"The writer has stopped, and lost {len(measurements)} measurements"
+                f" and {len(errors)} errors. {e=}")
+
+        finally:
+            db.close()
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+LocalCollector measures, with os.statvfs, the partitions that can be
+seen from the computer where dfstat is running, so that we do not
+have to fork ssh and df to ask about them. These are
+
+    1. all the partitions of a target that *is* this computer, and
+    2. partitions of other targets that are network filesystems
+        mounted here also, such as spdrstor01:/home.
+
+The numbers are in the same 1024-byte blocks that df -P reports.
+
+statvfs on a hung network mount never returns, so it is called in a
+thread of its own, and given up on after a timeout. The mount is then
+left to the remote df (which has its own timeout) until the stuck
+call comes back, so a hung mount costs at most one thread.
+"""
+import typing
+from   typing import *
+
+min_py = (3, 11)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import re
+import socket
+import threading
+
+###
+# Installed libraries.
+###
+
+
+###
+# From hpclib
+###
+import fileutils
+from   urdecorators import trap
+
+###
+# imports and objects that are a part of this project
+###
+
+
+###
+# Global objects and initializations
+###
+verbose = False
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+def statvfs_df(path:str) -> list:
+    """
+    [size, used, available] for the filesystem that contains path,
+    computed the way df -P computes them.
+    """
+    st = os.statvfs(path)
+    return [ st.f_blocks * st.f_frsize // 1024,
+        (st.f_blocks - st.f_bfree) * st.f_frsize // 1024,
+        st.f_bavail * st.f_frsize // 1024 ]
+
+
+def local_mounts(mtab:str='/proc/mounts') -> dict:
+    """
+    Map each mounted filesystem to its mount point on this computer.
+    The kernel writes spaces and tabs in the names as octal escapes.
+    """
+    unescape = lambda s : re.sub(r'\\([0-7]{3})', lambda m : chr(int(m[1], 8)), s)
+    mounts = {}
+    try:
+        with open(mtab) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 1:
+                    mounts[unescape(fields[0])] = unescape(fields[1])
+    except OSError as e:
+        pass
+    return mounts
+
+
+class LocalCollector:
+    """
+    Decide which targets can be measured here, and measure them.
+    """
+
+    def __init__(self, hostnames:Iterable=(), shared_filesystems:str=None,
+            timeout:float=10):
+        """
+        hostnames -- the names of the targets that are this computer,
+            in addition to its own host name.
+        shared_filesystems -- a file with one filesystem per line, in
+            the form host:/path, that may be mounted both here and on
+            the targets. Device names like /dev/mapper/vg_os-var are
+            ignored; every computer has its own.
+        timeout -- seconds to wait for statvfs on one mount.
+        """
+        me = socket.gethostname()
+        self.hostnames = { me, me.split('.')[0], 'localhost', *hostnames }
+
+        self.shared = set()
+        if shared_filesystems:
+            try:
+                with open(fileutils.expandall(shared_filesystems)) as f:
+                    self.shared = { _.strip() for _ in f if ':' in _ }
+            except OSError as e:
+                pass
+
+        self.mounts = { fs : mount for fs, mount in local_mounts().items()
+            if fs in self.shared }
+
+        # (host, partition) -> where that same filesystem is mounted here.
+        self.aliases = {}
+
+        # path -> the thread that is stuck in statvfs on it.
+        self.timeout = timeout
+        self.hung = {}
+        self.lock = threading.Lock()
+
+
+    def is_this_host(self, host:str) -> bool:
+        return host in self.hostnames
+
+
+    def learn(self, host:str, rows:Iterable) -> None:
+        """
+        Note which of a remote host's partitions are shared filesystems
+        that are mounted here, from the rows of its df output. The
+        next time around, they are measured locally.
+        """
+        for fs, _0, _1, _2, partition in rows:
+            if fs in self.mounts:
+                self.aliases[host, partition] = self.mounts[fs]
+
+
+    def statvfs(self, path:str) -> list:
+        """
+        statvfs_df(path), or TimeoutError (an OSError) if it does not 
+        return within the timeout, or if an earlier call on the same
+        path has still not returned.
+        """
+        with self.lock:
+            if (stuck := self.hung.get(path)) is not None:
+                if stuck.is_alive():
+                    raise TimeoutError(f"statvfs({path}) is still hung.")
+                del self.hung[path]
+
+        result = {}
+        def measure() -> None:
+            try:
+                result['value'] = statvfs_df(path)
+            except OSError as e:
+                result['error'] = e
+
+        t = threading.Thread(target=measure, name=f"statvfs {path}", daemon=True)
+        t.start()
+        t.join(self.timeout)
+        if t.is_alive():
+            with self.lock:
+                self.hung[path] = t
+            raise TimeoutError(f"statvfs({path}) did not return in {self.timeout} seconds.")
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+
+    @trap
+    def collect(self, host:str, partitions:Iterable) -> tuple:
+        """
+        Measure what we can here. Returns a dict like the one from
+        extract_df() and the list of partitions that must still be
+        measured on the host itself.
+        """
+        info = {}
+        remote = []
+        for partition in partitions:
+            if not partition.startswith('/'):
+                remote.append(partition)
+                continue
+
+            path = partition if self.is_this_host(host) else self.aliases.get((host, partition))
+            if path is None:
+                remote.append(partition)
+                continue
+            try:
+                info[partition] = self.statvfs(path)
+            except OSError as e:
+                remote.append(partition)
+
+        return info, remote
+
+
+if __name__ == "__main__":
+
+    collector = LocalCollector()
+    print(collector.collect(socket.gethostname(), sys.argv[1:] or ['/']))
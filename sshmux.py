@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+SSHMux keeps one long-lived, multiplexed ssh session (an OpenSSH
+ControlMaster) for each host that we query, so that every poll
+only pays for one command on an open channel rather than for the
+TCP connection, key exchange, and authentication.
+
+mux = SSHMux(sshconfig, '~/.ssh/dfstat', 600)
+result = dorunrun(mux.command('adam', 'df -P'), return_datatype=dict)
+
+The master for a host is started by the first command sent to it,
+and it exits by itself after it has been idle for `persist` seconds.
+"""
+import typing
+from   typing import *
+
+min_py = (3, 11)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import shlex
+import threading
+import time
+
+###
+# Installed libraries.
+###
+
+
+###
+# From hpclib
+###
+from   dorunrun import dorunrun
+import fileutils
+from   sloppytree import SloppyTree
+from   urdecorators import trap
+
+###
+# imports and objects that are a part of this project
+###
+
+
+###
+# Global objects and initializations
+###
+verbose = False
+
+###
+# ssh exits with 255 when the trouble is with the connection rather
+# than with the remote command.
+###
+SSH_CONNECTION_ERROR = 255
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+class SSHMux:
+    """
+    Build ssh commands that share one master connection per host.
+    The host information comes from the SSHConfig object.
+    """
+
+    def __init__(self, sshconfig:SloppyTree, control_dir:str, persist:int=600):
+        self.sshconfig = sshconfig
+        self.control_dir = fileutils.expandall(control_dir)
+        self.persist = persist
+        self.last_used = {}
+        self.lock = threading.Lock()
+        os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+
+
+    def control_path(self, host:str) -> str:
+        return os.path.join(self.control_dir, f"{host}.sock")
+
+
+    def destination(self, host:str) -> str:
+        hostinfo = SloppyTree(self.sshconfig[host])
+        return f"{hostinfo.user}@{hostinfo.hostname}"
+
+
+    def options(self, host:str) -> list:
+        """
+        The ssh options that attach this host's sessions to its master,
+        creating the master if it is not already running.
+        """
+        hostinfo = self.sshconfig[host]
+        opts = [
+            "-o", "BatchMode=yes",
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={self.control_path(host)}",
+            "-o", f"ControlPersist={self.persist}"
+            ]
+        if (port := hostinfo.get('port')):
+            opts.extend(["-p", str(port)])
+        if (identityfile := hostinfo.get('identityfile')):
+            opts.extend(["-i", fileutils.expandall(identityfile)])
+        return opts
+
+
+    def command(self, host:str, remote_cmd:str) -> str:
+        """
+        The command line to run remote_cmd on host over the shared
+        connection.
+        """
+        with self.lock:
+            self.last_used[host] = time.time()
+        return " ".join(shlex.quote(_) for _ in
+            ["ssh", *self.options(host), self.destination(host), remote_cmd])
+
+
+    @trap
+    def is_open(self, host:str) -> bool:
+        """
+        Ask the master for this host if it is still alive.
+        """
+        if not os.path.exists(self.control_path(host)):
+            return False
+        cmd = f"ssh -O check -o ControlPath={self.control_path(host)} {self.destination(host)}"
+        return dorunrun(cmd, return_datatype=bool)
+
+
+    @trap
+    def close(self, host:str) -> None:
+        """
+        Shut down the master for this host, and remove its socket
+        if the master was already gone and left it behind.
+        """
+        cmd = f"ssh -O exit -o ControlPath={self.control_path(host)} {self.destination(host)}"
+        try:
+            dorunrun(cmd, return_datatype=bool)
+        except Exception as e:
+            pass
+
+        try:
+            os.unlink(self.control_path(host))
+        except FileNotFoundError as e:
+            pass
+
+        with self.lock:
+            self.last_used.pop(host, None)
+
+
+    def reconnect(self, host:str) -> None:
+        """
+        Throw away a master that is no longer working. The next
+        command to the host starts a new one.
+        """
+        self.close(host)
+
+
+    def expire_idle(self) -> None:
+        """
+        ControlPersist makes the masters exit on their own, but a host
+        that has been removed from the config would otherwise leave its
+        socket behind forever.
+        """
+        now = time.time()
+        with self.lock:
+            idle = [ host for host, t in self.last_used.items()
+                if now - t > self.persist ]
+        for host in idle:
+            self.is_open(host) or self.close(host)
+
+
+    def close_all(self) -> None:
+        with self.lock:
+            hosts = tuple(self.last_used)
+        for host in hosts:
+            self.close(host)
+
+
+if __name__ == "__main__":
+
+    from sshconfig import SSHConfig
+
+    try:
+        mux = SSHMux(SSHConfig(sys.argv[2])(), '~/.ssh/dfstat')
+        print(mux.command(sys.argv[1], 'df -P'))
+    except IndexError as e:
+        print(f"Usage: {sys.argv[0]} host sshconfig-file")
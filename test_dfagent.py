@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the AgentListener, with agents pushing to it over the
+loopback interface.
+
+    python -m pytest test_dfagent.py
+"""
+import logging
+import socket
+import threading
+
+import pytest
+
+# dfagent needs hpclib.
+pytest.importorskip('sloppytree')
+
+from   dfagent import AgentListener, push
+
+
+class Writer:
+    """
+    Stands in for the MeasurementWriter, and keeps what it is given.
+    """
+    def __init__(self) -> None:
+        self.measurements = []
+        self.errors = []
+        self.puts = threading.Semaphore(0)
+
+    def put(self, measurements:list, errors:list=()) -> None:
+        self.measurements.extend(measurements)
+        self.errors.extend(errors)
+        self.puts.release()
+
+
+targets = {'adam': ['/home', 'ERROR'], 'boyi': ['/home', '/scratch', 'ERROR']}
+
+
+@pytest.fixture
+def writer() -> Writer:
+    return Writer()
+
+
+def listen(writer:Writer, **kwargs) -> AgentListener:
+    listener = AgentListener(writer, ('127.0.0.1', 0), targets,
+        logging.getLogger(__name__), **kwargs)
+    listener.start()
+    return listener
+
+
+def send(listener:AgentListener, writer:Writer, records:list) -> None:
+    assert push(records, listener.server_socket.getsockname())
+    assert writer.puts.acquire(timeout=10)
+
+
+def test_agents_on_localhost(writer:Writer) -> None:
+    """
+    Several agents on this computer, each for its own host.
+    """
+    listener = listen(writer, hosts=targets, allow=['127.0.0.1'])
+    try:
+        send(listener, writer, [
+            {'host': 'adam', 'partition': '/home', 'size': 100, 'used': 60, 'avail': 40, 'ts': 1000}])
+        send(listener, writer, [
+            {'host': 'boyi', 'partition': '/home', 'size': 200, 'used': 50, 'avail': 150, 'ts': 1001},
+            {'host': 'boyi', 'partition': '/scratch', 'error': 2, 'ts': 1001}])
+    finally:
+        listener.stop()
+
+    assert sorted(writer.measurements) == [
+        ('adam', '/home', 100, 40, 1000), ('boyi', '/home', 200, 150, 1001)]
+    assert writer.errors == [('boyi', 2, 1001)]
+
+
+def test_rejected_records(writer:Writer, monkeypatch) -> None:
+    """
+    Hosts that are not agent hosts, partitions that are not monitored,
+    and agent hosts arriving from an address that is not theirs.
+    """
+    getaddrinfo = socket.getaddrinfo
+    monkeypatch.setattr(socket, 'getaddrinfo', lambda host, *args, **kwargs:
+        [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('192.0.2.1', 0))] if host == 'adam'
+        else getaddrinfo(host, *args, **kwargs))
+
+    listener = listen(writer, hosts=['adam'], allow=['127.0.0.1'])
+    try:
+        send(listener, writer, [
+            {'host': 'boyi', 'partition': '/home', 'size': 200, 'used': 50, 'avail': 150, 'ts': 1001},
+            {'host': 'adam', 'partition': '/tmp', 'size': 100, 'used': 60, 'avail': 40, 'ts': 1000},
+            'not a record'])
+    finally:
+        listener.stop()
+
+    listener = listen(writer, hosts=['adam'])
+    try:
+        send(listener, writer, [
+            {'host': 'adam', 'partition': '/home', 'size': 100, 'used': 60, 'avail': 40, 'ts': 1000}])
+    finally:
+        listener.stop()
+
+    assert writer.measurements == []
+    assert writer.errors == []
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Archive: what is read from it must be what is read from
+the database, however late the samples arrive.
+
+    python -m pytest test_dfarchive.py
+"""
+import os
+
+import numpy
+import pytest
+
+# dfdata needs hpclib.
+pytest.importorskip('sqlitedb')
+pytest.importorskip('sloppytree')
+
+from   dfarchive import Archive, SEQ_FILE
+from   dfdata import DFStatsDB
+
+
+def assert_same(archive:Archive, db:DFStatsDB) -> None:
+    for partition in ('/home', '/'):
+        columns = archive.read('adam', partition)
+        rows = db.samples_since('adam', partition, -1)
+        assert list(zip(*(columns[_].tolist() for _ in ('ts', 'partition_size', 'avail_disk')))) == rows
+
+
+def test_late_samples(db:DFStatsDB, tmp_path) -> None:
+    archive = Archive(str(tmp_path / 'archive'))
+    db.record_round([('adam', '/home', 1000, 500 - k, 1000 + 300 * k) for k in range(10)])
+    assert archive.update(db) == 10
+    assert_same(archive, db)
+
+    # A round that was held up, and a sample that was stored again.
+    db.record_round([('adam', '/home', 1000, 400, 4000), ('adam', '/', 2000, 900, 1000)])
+    db.record_round([('adam', '/home', 1000, 300, 1150), ('adam', '/home', 1000, 200, 1300)])
+    assert archive.update(db) == 4
+    assert_same(archive, db)
+    assert archive.update(db) == 0
+
+
+def test_update_again(db:DFStatsDB, tmp_path) -> None:
+    """
+    A batch that is added again, as after a crash before the seq was
+    saved, changes nothing. An archive from before there was a seq is
+    caught up by ts.
+    """
+    archive = Archive(str(tmp_path / 'archive'))
+    db.record_round([('adam', '/home', 1000, 500 - k, 1000 + 300 * k) for k in range(10)])
+    archive.update(db)
+    db.record_round([('adam', '/home', 1000, 300, 1150), ('adam', '/home', 1000, 200, 5000)])
+    archive.update(db)
+
+    archive.set_seq(5)
+    archive.update(db)
+    assert_same(archive, db)
+
+    os.remove(os.path.join(archive.directory, SEQ_FILE))
+    db.record_round([('adam', '/home', 1000, 100, 6000)])
+    archive.update(db)
+    assert archive.seq() == db.last_seq()
+    assert_same(archive, db)
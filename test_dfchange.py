@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the ChangeDetector, with partitions that fill steadily and
+then lose a lot of space at once.
+
+    python -m pytest test_dfchange.py
+"""
+import pytest
+
+from   dfchange import ChangeDetector
+
+SIZE = 1_000_000
+
+
+def series(rate:float, n:int, drop_at:int=None, drop:float=0.05) -> list:
+    """
+    n measurements of a partition that loses rate of its size each
+    time, and drop of its size at once at measurement drop_at.
+    """
+    avail, rows = SIZE // 2, []
+    for k in range(n):
+        avail -= int(rate * SIZE) + (int(drop * SIZE) if k == drop_at else 0)
+        rows.append(('adam', '/home', SIZE, avail, 1000 + 300 * k))
+    return rows
+
+
+@pytest.mark.parametrize('drop_at', [1, 2, 3, 10, 40])
+def test_drop_after_start(drop_at:int) -> None:
+    """
+    A drop soon after the detector starts is not learned as the usual
+    rate; it is reported, and only once.
+    """
+    detector = ChangeDetector()
+    changes = detector.update(series(0.0, 60, drop_at))
+    assert [ _.ts for _ in changes ] == [1000 + 300 * drop_at]
+
+
+def test_steady_filling_with_seed() -> None:
+    """
+    A partition that fills faster than delta is quiet once its rate
+    is known, and a drop on top of that rate is still reported.
+    """
+    detector = ChangeDetector()
+    detector.seed([('adam', '/home', 0.002)])
+    assert detector.update(series(0.002, 200)) == []
+
+    detector = ChangeDetector()
+    detector.seed([('adam', '/home', 0.002)])
+    assert len(detector.update(series(0.002, 200, drop_at=2))) == 1
+
+
+def test_alert() -> None:
+    seen = []
+    detector = ChangeDetector(alert=seen.append)
+    changes = detector.update(series(0.0, 10, drop_at=5, drop=0.1))
+    assert seen == changes
+    change = changes[0]
+    assert change.avail_then - change.avail_now == int(0.1 * SIZE)
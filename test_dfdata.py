@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the writes in dfdata.py and dfwriter.py, against a database
+made from dfstat.sql (see conftest.py).
+
+    python -m pytest test_dfdata.py
+"""
+import contextlib
+import logging
+import sqlite3
+import time
+from   typing import Generator
+
+import pytest
+
+# dfdata needs hpclib.
+pytest.importorskip('sqlitedb')
+pytest.importorskip('sloppytree')
+
+from   dfdata import DFStatsDB
+from   dfwriter import MeasurementWriter
+
+
+def count(db:DFStatsDB, host:str, partition:str) -> int:
+    return db.db.execute("""SELECT count(*) FROM samples JOIN series USING (series_id)
+        WHERE host = ? AND partition = ?""", (host, partition)).fetchone()[0]
+
+
+def test_error_without_error_series(db:DFStatsDB) -> None:
+    """
+    spiderweb has no ERROR partition. Its error is skipped, and the
+    rest of the round is still written.
+    """
+    unmatched = []
+    db.record_round([('spiderweb', '/home', 100, 40, 1000), ('adam', '/home', 100, 50, 1000)],
+        [('spiderweb', 255, 1000), ('adam', 255, 1000)], unmatched=unmatched)
+
+    assert unmatched == [('spiderweb', 255, 1000)]
+    assert count(db, 'spiderweb', '/home') == 1
+    assert count(db, 'adam', '/home') == 1
+    assert count(db, 'adam', 'ERROR') == 1
+
+
+def test_measurement_without_series(db:DFStatsDB) -> None:
+    unmatched = []
+    db.record_round([('nobody', '/home', 100, 40, 1000), ('adam', '/', 100, 50, 1000)],
+        unmatched=unmatched)
+
+    assert unmatched == [('nobody', '/home', 100, 40, 1000)]
+    assert count(db, 'adam', '/') == 1
+
+
+def test_writer_keeps_measurement_times(database:str, db:DFStatsDB) -> None:
+    """
+    Measurements of one series that are written in the same batch
+    are all stored, each at the time it was made.
+    """
+    writer = MeasurementWriter(database, logging.getLogger(__name__), max_delay=60)
+    writer.start()
+    for i, ts in enumerate((1000, 1300, 1600)):
+        writer.put([('adam', '/home', 100, 50 - i, ts)])
+    writer.stop(10)
+
+    assert db.samples_since('adam', '/home', 0) == [(1000, 100, 50), (1300, 100, 49), (1600, 100, 48)]
+    assert db.db.execute("""SELECT n FROM df_stat_hourly 
+        WHERE host = 'adam' AND partition = '/home'""").fetchone()[0] == 3
+
+
+class FailingMaintenance:
+    def wait_time(self) -> float:
+        return 0
+
+    def step(self, db:DFStatsDB) -> None:
+        raise sqlite3.OperationalError("database is locked")
+
+
+def test_writer_survives_maintenance(database:str, db:DFStatsDB) -> None:
+    writer = MeasurementWriter(database, logging.getLogger(__name__), max_delay=0.1,
+        maintenance=FailingMaintenance())
+    writer.start()
+    writer.put([('adam', '/home', 100, 50, 1000)])
+    time.sleep(0.5)
+    writer.put([('adam', '/home', 100, 49, 1300)])
+    writer.stop(10)
+
+    assert count(db, 'adam', '/home') == 2
+
+
+def test_put_raises_when_writer_is_gone(tmp_path) -> None:
+    writer = MeasurementWriter(str(tmp_path / 'missing' / 'dfstat.db'), 
+        logging.getLogger(__name__))
+    writer.start()
+    writer.join(10)
+
+    with pytest.raises(RuntimeError):
+        writer.put([('adam', '/home', 100, 50, 1000)])
+
+
+def test_usual_rates(db:DFStatsDB) -> None:
+    """
+    adam:/home loses 10 blocks in each of 12 measurements an hour; the
+    rate counts the measurements after the first hour.
+    """
+    start = 1_700_000_000 - 1_700_000_000 % 3600
+    db.record_round([('adam', '/home', 100000, 50000 - 10 * k, start + 300 * k) for k in range(36)])
+    db.record_round([('adam', '/', 100000, 90000, start)])
+
+    rates = { (host, partition) : rate for host, partition, rate in db.usual_rates(start) }
+    assert rates['adam', '/home'] == pytest.approx(10 / 100000)
+    assert rates['adam', '/'] == 0.0
+    assert db.usual_rates(start + 86400) == []
+
+
+def test_rollup_backfill(db:DFStatsDB) -> None:
+    """
+    Rebuilding the rollups gives what was kept up to date as the
+    measurements were recorded, even when some of them came late.
+    """
+    rows = [('adam', '/home', 1000 + k, 500 - 7 * k, 1_700_000_000 + 600 * k) for k in range(30)]
+    rows[3], rows[4], rows[17], rows[12] = rows[4], rows[3], rows[12], rows[17]
+    for row in rows:
+        db.record_round([row])
+
+    rollups = "SELECT * FROM df_stat_{} ORDER BY host, partition, period"
+    before = { _ : db.db.execute(rollups.format(_)).fetchall() for _ in ('hourly', 'daily') }
+    db.rollup_backfill()
+    for name, rollup in before.items():
+        assert db.db.execute(rollups.format(name)).fetchall() == rollup
+
+
+def test_unmatched_after_retry(db:DFStatsDB, monkeypatch) -> None:
+    """
+    A round that is tried again after the database was busy reports
+    each row without a series once.
+    """
+    transaction = db.transaction
+    attempts = []
+
+    @contextlib.contextmanager
+    def busy_once() -> Generator:
+        with transaction() as cursor:
+            yield cursor
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(db, 'transaction', busy_once)
+    unmatched = []
+    db.record_round([('nobody', '/home', 100, 40, 1000), ('adam', '/', 100, 50, 1000)],
+        [('spiderweb', 255, 1000)], unmatched=unmatched)
+
+    assert len(attempts) == 2
+    assert unmatched == [('nobody', '/home', 100, 40, 1000), ('spiderweb', 255, 1000)]
+    assert count(db, 'adam', '/') == 1
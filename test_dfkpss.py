@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Parity of kpss_ct() with the KPSS test in statsmodels. The timing is
+in `python dfkpss.py`.
+
+    python -m pytest test_dfkpss.py
+"""
+import warnings
+
+import numpy
+import pytest
+
+stattools = pytest.importorskip('statsmodels.tsa.stattools')
+
+from   dfkpss import CRITICAL_VALUES, P_VALUES, kpss_ct, stationarity
+
+
+def theirs(x:numpy.ndarray) -> numpy.ndarray:
+    """
+    (statistic, p-value, lags) from statsmodels, a row for each series.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return numpy.array([ stattools.kpss(row, regression='ct', nlags='auto')[:3] for row in x ])
+
+
+def mine(x:numpy.ndarray) -> numpy.ndarray:
+    return numpy.column_stack(kpss_ct(x))
+
+
+def assert_same(x:numpy.ndarray) -> None:
+    """
+    The p-values are interpolated with a steep slope near the ends of
+    the table, which turns the rounding of the statistic into a 
+    relative difference of about 1e-9.
+    """
+    numpy.testing.assert_allclose(mine(x), theirs(x), rtol=1e-8, atol=0)
+
+
+def windows(rng:numpy.random.Generator, k:int, n:int) -> numpy.ndarray:
+    """
+    Random walks, trends, and noise, at the scale of avail_disk.
+    """
+    return numpy.vstack([
+        numpy.cumsum(rng.normal(size=(k, n)), axis=1),
+        numpy.arange(n) * rng.normal(size=(k, 1)) + rng.normal(size=(k, n)),
+        rng.normal(size=(k, n)) ]) * 1e6 + 1e10
+
+
+@pytest.mark.parametrize('n', [8, 12, 20, 50, 120, 365])
+def test_random_windows(n:int) -> None:
+    x = windows(numpy.random.default_rng(n), 30, n)
+    assert_same(x)
+
+
+@pytest.mark.parametrize('n', [20, 50])
+def test_step_windows(n:int) -> None:
+    """
+    A partition that was filling slowly, and then lost a lot at once.
+    """
+    rng = numpy.random.default_rng(n + 1)
+    k = numpy.arange(n)
+    x = (1e10 - 1e5 * k - numpy.where(k >= rng.integers(1, n - 1, size=(40, 1)), 1e9, 0)
+        + rng.normal(size=(40, n)) * 1e4)
+    assert_same(x)
+
+
+def test_flat_windows() -> None:
+    """
+    A window that is a straight line, flat or not, has no statistic,
+    and does not spoil the others that are tested with it.
+    """
+    n = 50
+    rng = numpy.random.default_rng(2)
+    x = numpy.vstack([ numpy.full(n, 1e10), 1e10 - 1e6 * numpy.arange(n), 
+        numpy.cumsum(rng.normal(size=n)) * 1e6 + 1e10 ])
+    statistic, p_value, lags = kpss_ct(x)
+
+    assert numpy.isnan(statistic[:2]).all() and numpy.isnan(p_value[:2]).all()
+    assert_same(x[2:])
+    numpy.testing.assert_allclose(mine(x)[2:], mine(x[2:]))
+
+
+def test_p_value_bounds() -> None:
+    """
+    Beyond the table, the p-values are clipped to its ends, as they
+    are in statsmodels; inside it, they are interpolated.
+    """
+    n = 100
+    t = numpy.arange(n)
+    rng = numpy.random.default_rng(3)
+    x = numpy.vstack([ t * t, numpy.abs(t - n // 2), t + rng.normal(size=(20, n)) ]) * 1e6 + 1e10
+    statistic, p_value, lags = kpss_ct(x)
+    assert (statistic[:2] > CRITICAL_VALUES[-1]).all()
+    assert (p_value[:2] == P_VALUES[-1]).all()
+
+    low = statistic < CRITICAL_VALUES[0]
+    inside = ~low & (statistic < CRITICAL_VALUES[-1])
+    assert low.any() and inside.any()
+    assert (p_value[low] == P_VALUES[0]).all()
+    assert ((p_value[inside] <= P_VALUES[0]) & (p_value[inside] > P_VALUES[-1])).all()
+    assert_same(x)
+
+
+def test_stationarity_mixed_lengths() -> None:
+    """
+    Windows of different lengths get the same p-values as they would
+    alone, and the ones too short to test get nan.
+    """
+    rng = numpy.random.default_rng(4)
+    avails = [ row for n in (20, 50, 2) for row in windows(rng, 2, n) ]
+    rng.shuffle(avails)
+    p_values = stationarity(avails)
+    for a, p in zip(avails, p_values):
+        if len(a) < 3:
+            assert numpy.isnan(p)
+        else:
+            assert p == pytest.approx(theirs([a])[0, 1], rel=1e-8)
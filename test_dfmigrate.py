@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the conversion of a version 2 database, in which
+partition_size was the space used on the partition.
+
+    python -m pytest test_dfmigrate.py
+"""
+import argparse
+import os
+import sqlite3
+
+import pytest
+
+# dfdata needs hpclib.
+pytest.importorskip('sqlitedb')
+pytest.importorskip('sloppytree')
+
+from   dfdata import DFStatsDB, SCHEMA_VERSION
+from   dfmigrate import dfmigrate_main
+
+
+def test_version_2_sizes(database:str) -> None:
+    """
+    adam:/home is 1000 blocks, with 600 and then 550 available; the
+    old rows have the space used.
+    """
+    db = DFStatsDB(database)
+    db.record_round([('adam', '/home', 400, 600, 1000), ('adam', '/home', 450, 550, 1300)],
+        [('adam', 255, 1300)])
+    db.close()
+    conn = sqlite3.connect(database)
+    conn.executescript("""DROP INDEX samples_seq; DROP TRIGGER df_stat_insert;
+        ALTER TABLE samples DROP COLUMN seq; PRAGMA user_version = 2;""")
+    conn.close()
+
+    with pytest.raises(sqlite3.DatabaseError):
+        DFStatsDB(database)
+
+    myargs = argparse.Namespace(database=database, force=False, no_vacuum=True, rollups=False)
+    assert dfmigrate_main(myargs) == os.EX_OK
+
+    db = DFStatsDB(database)
+    try:
+        assert db.db.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        assert db.samples_since('adam', '/home', 0) == [(1000, 1000, 600), (1300, 1000, 550)]
+        assert db.db.execute("""SELECT min_size, max_size, sum_size, last_size 
+            FROM df_stat_hourly WHERE host = 'adam' AND partition = '/home'""").fetchall() == [
+            (1000, 1000, 2000, 1000)]
+        assert db.db.execute("""SELECT partition_size FROM current_state 
+            WHERE host = 'adam' AND partition = '/home'""").fetchone()[0] == 1000
+        assert db.db.execute("""SELECT error_code FROM current_state 
+            WHERE host = 'adam' AND partition = 'ERROR'""").fetchone()[0] == 255
+
+        # The good samples are numbered in the order of their times, 
+        # and the ones stored from now on go after them.
+        db.record_round([('adam', '/home', 1000, 500, 1200)])
+        db.db.execute("""INSERT INTO df_stat (host, partition, partition_size, avail_disk, ts)
+            VALUES ('adam', '/', 2000, 1000, 1100)""")
+        assert [ _[:4] for _ in db.stored_since(0, 10) ] == [
+            (1, 'adam', '/home', 1000), (2, 'adam', '/home', 1300),
+            (3, 'adam', '/home', 1200), (4, 'adam', '/', 1100)]
+    finally:
+        db.close()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the parsing of the df -P output that the hosts send back.
+
+    python -m pytest test_dfstat.py
+"""
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+# dfstat needs hpclib.
+pytest.importorskip('sqlitedb')
+pytest.importorskip('sloppytree')
+pytest.importorskip('dorunrun')
+
+from   sloppytree import SloppyTree
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+HEADER = "Filesystem                     1024-blocks      Used  Available Capacity Mounted on"
+
+
+@pytest.fixture(scope='module')
+def dfstat(tmp_path_factory) -> object:
+    """
+    dfstat reads its config, and opens its database and log, in the
+    directory where it is imported.
+    """
+    where = tmp_path_factory.mktemp('dfstat')
+    shutil.copy(os.path.join(here, 'dfstat.toml'), where)
+    with open(os.path.join(here, 'dfstat.sql')) as f:
+        conn = sqlite3.connect(where / 'dfstat.db')
+        conn.executescript(f.read())
+        conn.close()
+
+    cwd = os.getcwd()
+    os.chdir(where)
+    try:
+        import dfstat
+    finally:
+        os.chdir(cwd)
+    return dfstat
+
+
+def test_rows(dfstat:object) -> None:
+    lines = f"""{HEADER}
+/dev/mapper/rl-root               73334784  16797908   56536876      23% /
+/dev/mapper/rl-home             1795845384 146868444 1648976940       9% /home
+""".splitlines()
+    assert dfstat.extract_df(lines, ['/', '/home', 'ERROR']) == {
+        '/': [73334784, 16797908, 56536876],
+        '/home': [1795845384, 146868444, 1648976940]}
+
+
+def test_wrapped_filesystem(dfstat:object) -> None:
+    """
+    A filesystem name that is too long for its column is on a line of
+    its own, and the numbers are on the next line.
+    """
+    lines = f"""{HEADER}
+141.166.186.35:/mnt/usrlocal/8/a/filesystem/name/that/is/very/long
+                                3766283008 263690368 3502592640       8% /usr/local/chem.sw
+/dev/md125                      1343253684 135131388 1208122296      11% /oldhome
+""".splitlines()
+    assert list(dfstat.df_rows(lines)) == [
+        ('141.166.186.35:/mnt/usrlocal/8/a/filesystem/name/that/is/very/long',
+            3766283008, 263690368, 3502592640, '/usr/local/chem.sw'),
+        ('/dev/md125', 1343253684, 135131388, 1208122296, '/oldhome')]
+    assert dfstat.extract_df(lines, ['/usr/local/chem.sw']) == {
+        '/usr/local/chem.sw': [3766283008, 263690368, 3502592640]}
+
+
+def test_spaces_in_mount_point(dfstat:object) -> None:
+    lines = f"""{HEADER}
+/dev/sdb1                         1000       400        600      40% /mnt/lab data
+//server/share name               2000      1000       1000      50% /mnt/share  two
+""".splitlines()
+    assert dfstat.extract_df(lines, ['/mnt/lab data', '/mnt/share  two', '/mnt/lab']) == {
+        '/mnt/lab data': [1000, 400, 600],
+        '/mnt/share  two': [2000, 1000, 1000]}
+
+
+def test_one_df_per_partition(dfstat:object) -> None:
+    """
+    The output of several df commands, each with its own header.
+    """
+    lines = f"""{HEADER}
+/dev/mapper/rl-root               73334784  16797908   56536876      23% /
+{HEADER}
+/dev/mapper/rl-home             1795845384 146868444 1648976940       9% /home
+""".splitlines()
+    assert sorted(dfstat.extract_df(lines, ['/', '/home'])) == ['/', '/home']
+
+
+def test_header_only(dfstat:object) -> None:
+    assert dfstat.extract_df([HEADER], ['/', '/home']) == {}
+    assert dfstat.extract_df([], ['/']) == {}
+
+
+def test_missing_partition(dfstat:object) -> None:
+    """
+    One df failed (its message went to stderr), and the last df's exit
+    code is the host's. The error is recorded for the host's ERROR 
+    row, and the partitions that did answer are kept.
+    """
+    stdout = f"""{HEADER}
+/dev/mapper/rl-root               73334784  16797908   56536876      23% /
+"""
+    errors = []
+    lines = dfstat.df_lines('adam', SloppyTree({'OK': False, 'code': 1, 'stdout': stdout}),
+        errors, 1000)
+    assert errors == [('adam', 1, 1000)]
+    assert dfstat.extract_df(lines, ['/', '/home']) == {'/': [73334784, 16797908, 56536876]}
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the windows that the analyzer keeps between cycles: they
+must hold what the database would give if it were asked again.
+
+    python -m pytest test_dfwindow.py
+"""
+import random
+
+import numpy
+import pytest
+
+# dfdata needs hpclib.
+pytest.importorskip('sqlitedb')
+pytest.importorskip('sloppytree')
+
+from   dfarchive import Archive
+from   dfdata import DFStatsDB
+from   dfwindow import WindowCache
+
+targets = {'adam': ['/home', 'ERROR']}
+
+
+def record(db:DFStatsDB, rng:random.Random, ts:int, avail:int, n:int) -> tuple:
+    """
+    n more samples of adam:/home at irregular times, some of them
+    unchanged, as a Deadband would leave them, and sometimes one that
+    arrives after a later one.
+    """
+    for _ in range(n):
+        ts += rng.randrange(300, 2400)
+        avail -= rng.choice((0, 0, rng.randrange(1, 1000)))
+        db.record_round([('adam', '/home', 100000, avail, ts)])
+
+    # Now and then, one that was held up.
+    if n and rng.random() < 0.2:
+        db.record_round([('adam', '/home', 100000, avail + 50, ts - rng.randrange(1, 3000))])
+    return ts, avail
+
+
+@pytest.mark.parametrize('archived', [False, True])
+@pytest.mark.parametrize('step', [0, 3600])
+def test_window_follows_database(db:DFStatsDB, tmp_path, step:int, archived:bool) -> None:
+    """
+    The windows are warmed (from the database or the archive) and
+    then advanced for 60 cycles, with a few samples between cycles.
+    """
+    window_size = 10
+    rng = random.Random(20)
+    windows = WindowCache(window_size, step)
+    archive = Archive(str(tmp_path / 'archive')) if archived else None
+    ts, avail = record(db, rng, 1_700_000_000, 50000, 30)
+
+    for cycle in range(60):
+        if archive is not None:
+            archive.update(db)
+        windows.refresh(db, targets, archive)
+        w = windows['adam', '/home'].columns()
+        if step:
+            expected = db.step_arrays('adam', '/home', window_size, step)
+        else:
+            expected = db.recent_arrays('adam', '/home', window_size)
+        for column, expected_column in zip(w, expected):
+            numpy.testing.assert_array_equal(column, expected_column)
+        ts, avail = record(db, rng, ts, avail, rng.randrange(0, 4))